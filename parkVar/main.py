@@ -12,7 +12,7 @@ if __name__ == '__main__':
         try:
             item.unlink()
         except Exception as e:
-            logger.error(f"Failed to delete {item}: {e}")
+            logger.error("Failed to delete %s: %s", item, e)
 
     logger.info("Data directory deleted")
 
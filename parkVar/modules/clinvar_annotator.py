@@ -1,3 +1,8 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
 import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional
@@ -9,12 +14,32 @@ from requests import RequestException
 from parkVar.utils.logger_config import logger
 
 # Step 1: Define constants for ClinVar API
-"""Currently queries single HGVS at a time, could
-be extended to batch queries in future versions.
+"""Searches a single HGVS at a time, then fetches the esummaries for all
+matched UIDs in batches.
 """
 
 EUTILS_BASE = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
 NCBI_RATE_LIMIT_SLEEP = 0.34  # ~3 requests/sec as per NCBI
+ESUMMARY_BATCH_SIZE = 200  # UIDs per esummary request
+
+# ClinVar responses are kept on disk across sessions, so variants seen in
+# earlier uploads are not requested again until the entry expires
+CACHE_PATH = (
+    Path(__file__).resolve().parent.parent.parent
+    / "cache"
+    / "clinvar_cache.sqlite3"
+)
+CACHE_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+
+# Columns added to the input DataFrame by annotate_dataframe
+ANNOTATION_COLUMNS = [
+    "clinvar_uid",
+    "classification",
+    "review_status_text",
+    "star_rating",
+    "disease_name",
+    "disease_mim",
+]
 
 REVIEW_STATUS_TO_STARS = {
     "practice guideline": 4,
@@ -26,9 +51,159 @@ REVIEW_STATUS_TO_STARS = {
 }
 
 
+@functools.lru_cache(maxsize=64)
+def review_status_to_stars(review_status_text: str) -> Optional[int]:
+    """
+    Map a ClinVar review status to its star rating.
+
+    Known statuses are looked up in REVIEW_STATUS_TO_STARS, and other
+    wordings are matched on key phrases. ClinVar uses only a handful of
+    statuses, so results are cached per status text.
+
+    Parameters
+    ----------
+    review_status_text : str
+        Review status from an esummary.
+
+    Returns
+    -------
+    int or None
+        Star rating (0-4), or None if the status is not recognised.
+    """
+
+    normalized = review_status_text.strip().lower()
+    if normalized in REVIEW_STATUS_TO_STARS:
+        return REVIEW_STATUS_TO_STARS[normalized]
+    if "practice guideline" in normalized:
+        return 4
+    if "expert panel" in normalized:
+        return 3
+    if "multiple submitters" in normalized and "no conflicts" in normalized:
+        return 2
+    if "criteria provided" in normalized and "single submitter" in normalized:
+        return 1
+    if (
+        "no assertion criteria provided" in normalized
+        or "no classification provided" in normalized
+    ):
+        return 0
+    return None
+
+
 # Step 2: Query ClinVar API using defined parameters and rate limiting
 
 
+class ClinVarCache:
+    """
+    SQLite cache of ClinVar search results and esummaries, keyed by the
+    SHA-256 of the request type and term.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_PATH,
+        max_age: float = CACHE_MAX_AGE,
+    ):
+        """
+        Open (or create) the cache database.
+
+        Parameters
+        ----------
+        path : pathlib.Path
+            SQLite database file. Its directory is created if needed.
+        max_age : float
+            Seconds after which a cached response is fetched again.
+
+        Raises
+        ------
+        OSError or sqlite3.Error
+            If the database cannot be created or opened.
+        """
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        # The connection may be used from the annotation worker thread, so
+        # access is serialised with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clinvar_cache ("
+            "key BLOB PRIMARY KEY, payload TEXT NOT NULL, "
+            "fetched_at INTEGER NOT NULL)"
+        )
+
+    @staticmethod
+    def _key(kind: str, term: str) -> bytes:
+        """Return the cache key for a request type and term."""
+        return hashlib.sha256(f"{kind}:{term}".encode("utf-8")).digest()
+
+    def get(self, kind: str, term: str) -> Optional[Any]:
+        """
+        Return a cached response, or None if missing, expired or unreadable.
+
+        Parameters
+        ----------
+        kind : str
+            Request type, e.g. 'esearch' or 'esummary'.
+        term : str
+            HGVS string or UID the request was made for.
+
+        Returns
+        -------
+        Any or None
+            The cached JSON-decoded response.
+        """
+
+        cutoff = int(time.time() - self.max_age)
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload FROM clinvar_cache "
+                    "WHERE key = ? AND fetched_at >= ?",
+                    (self._key(kind, term), cutoff),
+                ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("ClinVar cache read failed: %s", exc)
+            return None
+        return None if row is None else json.loads(row[0])
+
+    def set(self, kind: str, term: str, payload: Any) -> None:
+        """
+        Store a response. Failures are logged, not raised.
+
+        Parameters
+        ----------
+        kind : str
+            Request type, e.g. 'esearch' or 'esummary'.
+        term : str
+            HGVS string or UID the request was made for.
+        payload : Any
+            JSON-serialisable response to store.
+        """
+
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO clinvar_cache VALUES (?, ?, ?)",
+                    (
+                        self._key(kind, term),
+                        json.dumps(payload),
+                        int(time.time()),
+                    ),
+                )
+        except sqlite3.Error as exc:
+            logger.warning("ClinVar cache write failed: %s", exc)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
 class ClinVarClient:
     """
     ClinVar API client to return uid for input HGVS, and then fetch esummary
@@ -39,6 +214,7 @@ class ClinVarClient:
         self,
         session: Optional[requests.Session] = None,
         rate_limit_sleep: float = NCBI_RATE_LIMIT_SLEEP,
+        cache: Optional[ClinVarCache] = None,
     ):
         """
         Initiate the API client.
@@ -50,10 +226,14 @@ class ClinVarClient:
             to use for HTTP calls, incorporating rate limiting.
         rate_limit_sleep : float
             Seconds between requests for NCBI rate limit.
+        cache : ClinVarCache or None
+            Cache of earlier responses. Every lookup is requested from
+            NCBI if not given.
         """
 
         self.session = session or requests.Session()
         self.rate_limit_sleep = rate_limit_sleep
+        self.cache = cache
 
     def _get_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -108,6 +288,11 @@ class ClinVarClient:
             List of matching ClinVar UIDs (may be empty if no match/error).
         """
 
+        if self.cache is not None:
+            uids = self.cache.get("esearch", hgvs)
+            if uids is not None:
+                return uids
+
         url = f"{EUTILS_BASE}/esearch.fcgi"
         params = {"db": "clinvar", "term": hgvs, "retmode": "json"}
         try:
@@ -118,6 +303,10 @@ class ClinVarClient:
                 "Failed to search ClinVar for %s: %s", hgvs, exc, exc_info=True
             )
             return []  # return empty list on fail (logged)
+        # Empty results aren't cached, as NCBI sometimes returns them for a
+        # request that failed, and they would then be kept for CACHE_MAX_AGE
+        if uids and self.cache is not None:
+            self.cache.set("esearch", hgvs, uids)
         time.sleep(self.rate_limit_sleep)
         return uids
 
@@ -137,6 +326,11 @@ class ClinVarClient:
             or and error occurs, an empty dict is returned
         """
 
+        if self.cache is not None:
+            esum = self.cache.get("esummary", uid)
+            if esum is not None:
+                return esum
+
         url = f"{EUTILS_BASE}/esummary.fcgi"
         params = {"db": "clinvar", "id": uid, "retmode": "json"}
         try:
@@ -150,9 +344,71 @@ class ClinVarClient:
                 exc_info=True,
             )
             return {}
+        # Empty results aren't cached (see search_hgvs)
+        if esum and self.cache is not None:
+            self.cache.set("esummary", uid, esum)
         time.sleep(self.rate_limit_sleep)
         return esum
 
+    def fetch_esummaries(
+        self, uids: List[str], batch_size: int = ESUMMARY_BATCH_SIZE
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch esummary entries for many ClinVar UIDs in batched requests.
+
+        esummary accepts a comma-separated list of UIDs, so one request is
+        made per `batch_size` UIDs instead of one per UID. UIDs found in
+        the cache are not requested.
+
+        Parameters
+        ----------
+        uids : list
+            ClinVar UIDs to fetch.
+        batch_size : int
+            Maximum number of UIDs per request.
+
+        Returns
+        -------
+        esums : dict
+            Mapping from UID to its esummary dictionary. UIDs that return
+            nothing map to an empty dict, and UIDs in a batch that failed
+            are left out (logged).
+        """
+
+        esums = {}
+        if self.cache is not None:
+            for uid in uids:
+                esum = self.cache.get("esummary", uid)
+                if esum is not None:
+                    esums[uid] = esum
+            uids = [uid for uid in uids if uid not in esums]
+
+        url = f"{EUTILS_BASE}/esummary.fcgi"
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start : start + batch_size]
+            params = {
+                "db": "clinvar",
+                "id": ",".join(batch),
+                "retmode": "json",
+            }
+            try:
+                result = self._get_json(url, params).get("result", {})
+            except Exception as exc:
+                logger.error(
+                    "Failed to fetch esummaries for UIDs %s: %s",
+                    ",".join(batch),
+                    exc,
+                    exc_info=True,
+                )
+                continue
+            for uid in batch:
+                esums[uid] = result.get(uid, {}) or {}
+                # Empty results aren't cached (see search_hgvs)
+                if esums[uid] and self.cache is not None:
+                    self.cache.set("esummary", uid, esums[uid])
+            time.sleep(self.rate_limit_sleep)
+        return esums
+
     @staticmethod
     def extract_disease_from_trait_set(
         clin_sig: Dict[str, Any],
@@ -241,31 +497,7 @@ class ClinVarClient:
         star_rating: Optional[int] = None
 
         if isinstance(review_status_text, str):
-            normalized = review_status_text.strip().lower()
-            if normalized in REVIEW_STATUS_TO_STARS:
-                star_rating = REVIEW_STATUS_TO_STARS[normalized]
-            else:
-                if "practice guideline" in normalized:
-                    star_rating = 4
-                elif "expert panel" in normalized:
-                    star_rating = 3
-                elif (
-                    "multiple submitters" in normalized
-                    and "no conflicts" in normalized
-                ):
-                    star_rating = 2
-                elif (
-                    "criteria provided" in normalized
-                    and "single submitter" in normalized
-                ):
-                    star_rating = 1
-                elif (
-                    "no assertion criteria provided" in normalized
-                    or "no classification provided" in normalized
-                ):
-                    star_rating = 0
-                else:
-                    star_rating = None
+            star_rating = review_status_to_stars(review_status_text)
 
         disease_info = ClinVarClient.extract_disease_from_trait_set(clin_sig)
         return {
@@ -320,42 +552,65 @@ def annotate_dataframe(
         raise ValueError("No variants to annotate")
 
     out = df.copy()
-    for col in [
-        "clinvar_uid",
-        "classification",
-        "review_status_text",
-        "star_rating",
-        "disease_name",
-        "disease_mim",
-    ]:
+    for col in ANNOTATION_COLUMNS:
         if col not in out.columns:
             out[col] = "annotation failed"
 
-    for idx, row in out.iterrows():
-        hgvs_input = row["t_hgvs"]
+    # Search each distinct HGVS for its first ClinVar UID. Searches stay
+    # sequential to respect the NCBI rate limit. Variants that failed
+    # validation have no HGVS and are not searched
+    hgvs_uids = {}
+    for hgvs_input in out["t_hgvs"].dropna().unique():
         logger.info("Processing variant: %s", hgvs_input)
         try:
             uids = client.search_hgvs(hgvs_input)
-            if not uids:
-                logger.debug("No ClinVar UID found for %s", hgvs_input)
-                continue
-            uid = uids[0]
-            logger.debug("Using ClinVar UID %s for %s", uid, hgvs_input)
-            esummary = client.fetch_esummary(uid)
-            extracted = client.extract_consensus_and_stars(esummary)
-
-            out.at[idx, "clinvar_uid"] = str(uid)
-            out.at[idx, "classification"] = extracted["classification"]
-            out.at[idx, "review_status_text"] = extracted["review_status_text"]
-            out.at[idx, "star_rating"] = extracted["star_rating"]
-            out.at[idx, "disease_name"] = extracted["disease_name"]
-            out.at[idx, "disease_mim"] = extracted["disease_mim"]
-
         except Exception as exc:
             logger.warning(
                 "Error annotating %s: %s", hgvs_input, exc, exc_info=True
             )
             continue
+        if not uids:
+            logger.debug("No ClinVar UID found for %s", hgvs_input)
+            continue
+        hgvs_uids[hgvs_input] = str(uids[0])
+        logger.debug("Using ClinVar UID %s for %s", uids[0], hgvs_input)
+
+    # Fetch the esummaries of all matched UIDs in batched requests
+    unique_uids = list(dict.fromkeys(hgvs_uids.values()))
+    esummaries = client.fetch_esummaries(unique_uids)
+
+    annotations = {}
+    for hgvs_input, uid in hgvs_uids.items():
+        try:
+            extracted = client.extract_consensus_and_stars(
+                esummaries.get(uid, {})
+            )
+            annotations[hgvs_input] = [uid] + [
+                extracted[col] for col in ANNOTATION_COLUMNS[1:]
+            ]
+        except Exception as exc:
+            logger.warning(
+                "Error annotating %s: %s", hgvs_input, exc, exc_info=True
+            )
+
+    if not annotations:
+        return out
+
+    # Map every row to its variant's annotation one column at a time.
+    # Object dtype keeps integer star ratings from becoming floats
+    found = pd.DataFrame.from_dict(
+        annotations,
+        orient="index",
+        columns=ANNOTATION_COLUMNS,
+        dtype=object,
+    )
+    annotated = out["t_hgvs"].isin(found.index)
+    out = out.assign(
+        **{
+            col: out["t_hgvs"].map(found[col]).where(annotated, out[col])
+            for col in ANNOTATION_COLUMNS
+        }
+    )
 
     return out
 
@@ -376,7 +631,8 @@ def process_variants_file(
     input_csv : pathlib.Path
         Path to the input CSV file to read.
     client : ClinVarClient or None, optional
-        ClinVarClient for annotation. If none, client is created.
+        ClinVarClient for annotation. If none, a client using the on-disk
+        ClinVarCache is created.
     output_name : str, optional
         Output CSV file written to the same directory as input_csv.
 
@@ -390,7 +646,6 @@ def process_variants_file(
     Exception
         If reading the input CSV fails, an exception with context is raised.
     """
-    client = client or ClinVarClient()
     try:
         df = pd.read_csv(input_csv)
     except Exception as e:
@@ -399,7 +654,20 @@ def process_variants_file(
         )
         raise
 
-    annotated = annotate_dataframe(df, client)
+    # Cache opened here, so closed here once annotation is done
+    cache = None
+    if client is None:
+        try:
+            cache = ClinVarCache()
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("ClinVar cache unavailable: %s", exc)
+        client = ClinVarClient(cache=cache)
+
+    try:
+        annotated = annotate_dataframe(df, client)
+    finally:
+        if cache is not None:
+            cache.close()
 
     output_csv = input_csv.parent / output_name
     try:
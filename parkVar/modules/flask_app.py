@@ -13,15 +13,22 @@ Group: 4
 
 Notes:
 - Temporary data are written to the 'data' directory at project root
-- Templates are injected via render_template_string and stored in flask_utils
+- Templates are stored and precompiled in flask_utils
 """
 
+import functools
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from flask import (
     Flask,
+    flash,
+    jsonify,
     redirect,
-    render_template_string,
     request,
     url_for,
 )
@@ -32,9 +39,30 @@ from parkVar.utils import flask_utils
 from parkVar.utils import upload_helpers as uploads
 from parkVar.utils.logger_config import logger
 
+# Temporary data directory at project root, resolved once at import rather
+# than on every request. Routes read it from the app config
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+
 # Create Flask object
 app = Flask(__name__)
 app.secret_key = "AGE"
+app.config["DATA_DIR"] = DATA_DIR
+
+# Validation and annotation run as background jobs so the request handler
+# returns straight away. The work is spent waiting on the Variant Validator
+# and ClinVar APIs, so a thread is enough, and one worker keeps jobs from
+# writing to the data directory at the same time.
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_JOBS = {}
+
+# Finished jobs are kept for this many seconds so their result pages can
+# be shown, then forgotten. Finish times are recorded by _job_finished
+JOB_TTL = 3600
+_JOB_FINISHED = {}
+
+# Number of times the session has been refreshed. A job started before a
+# refresh removes its output files when it finishes (see _annotation_job)
+_refresh_count = 0
 
 
 @app.errorhandler(flask_utils.AppError)
@@ -52,7 +80,12 @@ def global_error_handler(e):
     tuple
         A tuple of (rendered HTML, HTTP status code).
     """
-    return render_template_string(flask_utils.ERROR_TEMPLATE, msg=str(e)), 400
+    return (
+        flask_utils.render_static_template(
+            flask_utils.ERROR_TEMPLATE, msg=str(e)
+        ),
+        400,
+    )
 
 
 ############################################################################
@@ -72,9 +105,10 @@ def upload():
     POST
     ----
     1. Accept a file upload.
-    2. Convert it to a pandas DataFrame.
-    3. Persist it to the temporary data directory.
-    4. Render the uploaded data as an HTML table.
+    2. Stop if the file was already uploaded.
+    3. Convert it to a pandas DataFrame.
+    4. Persist it to the temporary data directory and record the upload.
+    5. Render the uploaded data as an HTML table.
 
     Returns
     -------
@@ -85,34 +119,43 @@ def upload():
     table_html = None
 
     if request.method == "GET":
-        return render_template_string(flask_utils.UPLOAD_TEMPLATE)
+        return flask_utils.render_static_template(flask_utils.UPLOAD_TEMPLATE)
 
     # UPLOAD FILE
     file = uploads._upload_file(request)
-
-    # CREATE AND MODIFY PANDAS DATAFRAME
-    df = uploads._create_pandas_dataframe(file)
-    logger.info("Input dataframe created")
+    if isinstance(file, tuple):
+        # No file was uploaded, so show the upload page again
+        return file
 
     # CREATE TEMP DATA DIRECTORY
-    data_dir = Path(__file__).resolve().parent.parent.parent / "data"
+    data_dir = app.config["DATA_DIR"]
     data_dir.mkdir(exist_ok=True)
     logger.info("Data directory created")
 
     # CHECK IF FILE HAS ALREADY BEEN UPLOADED
-    uploads._check_existing_files(file, data_dir)
+    # Checked before parsing so duplicates are not parsed or written
+    duplicate_page = uploads._check_existing_files(file, data_dir)
+    if duplicate_page is not None:
+        return duplicate_page
+
+    # CREATE AND MODIFY PANDAS DATAFRAME
+    df = uploads._create_pandas_dataframe(file)
+    logger.info("Input dataframe created")
 
     # STORE DATA AS CSV
     uploads._write_to_csv(data_dir, file, df)
     logger.info("Input written to CSV")
 
+    # RECORD THE UPLOAD FOR LATER DUPLICATE CHECKS
+    uploads._record_upload(data_dir, file.filename)
+
     # CREATE TABLE
     # Render the CSV as an HTML table using the template string
     table_html = flask_utils.create_table(df)
     logger.info("HTML table created")
 
-    return render_template_string(
-        flask_utils.UPLOAD_ANNO_TEMPLATE + table_html
+    return flask_utils.render_static_template(
+        flask_utils.UPLOAD_ANNO_TEMPLATE, table=table_html
     )
 
 
@@ -136,12 +179,37 @@ def refresh_session(data_dir):
         Redirect response to the upload route.
     """
 
-    # Delete all files in the temporary data directory
-    for item in data_dir.glob("*"):
-        try:
-            item.unlink()
-        except Exception as e:
-            logger.error(f"Failed to delete {item}: {e}")
+    # Let queued filtered CSV writes finish so they can't recreate files
+    # after the directory has been cleared
+    filters._wait_for_writes()
+
+    # Drop annotation jobs that haven't started. A running job can't be
+    # stopped, so it is left to finish and remove its own output files.
+    # The jobs are forgotten, so their result pages send the user back to
+    # upload
+    global _refresh_count
+    _refresh_count += 1
+    for job_id in list(_JOBS):
+        job = _JOBS.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+    _JOB_FINISHED.clear()
+
+    # Delete everything in the temporary data directory but keep the
+    # directory itself, which may be a mounted volume (see
+    # docker-compose.yml) that can't be removed
+    try:
+        with os.scandir(data_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError as e:
+                    logger.error("Failed to delete %s: %s", entry.path, e)
+    except FileNotFoundError:
+        pass
 
     logger.info("Data directory deleted")
 
@@ -160,7 +228,7 @@ def refresh_route():
     werkzeug.wrappers.response.Response
         Redirect response to the upload route.
     """
-    data_dir = Path(__file__).resolve().parent.parent.parent / "data"
+    data_dir = app.config["DATA_DIR"]
     return refresh_session(data_dir)
 
 
@@ -169,42 +237,209 @@ def refresh_route():
 ############################################################################
 
 
+def _annotation_job(refresh_count, input_path, validator_path):
+    """
+    Validate and annotate the input variant file as a background job.
+
+    Parameters
+    ----------
+    refresh_count : int
+        Value of `_refresh_count` when the job was started.
+    input_path : pathlib.Path
+        Path to the input CSV file containing raw variant data.
+    validator_path : pathlib.Path
+        Path where the validated CSV should be written. The annotated CSV is
+        written to the same directory.
+
+    Raises
+    ------
+    flask_utils.MissingFileError
+        If an input file does not exist.
+    flask_utils.ProcessError
+        If validation or annotation fails.
+    """
+    try:
+        anno._run_pipeline(input_path, validator_path)
+    finally:
+        # The session was refreshed while the job ran, so remove what it
+        # wrote. Later jobs only start once this one has finished
+        if refresh_count != _refresh_count:
+            for path in [
+                validator_path,
+                validator_path.with_name("anno_data.csv"),
+            ]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            logger.info("Removed output of annotation job after refresh")
+
+
+def _job_finished(job_id, future):
+    """
+    Record when a background job finished, for `_sweep_jobs`.
+
+    Parameters
+    ----------
+    job_id : str
+        ID of the job.
+    future : concurrent.futures.Future
+        The finished job.
+    """
+    _JOB_FINISHED[job_id] = time.monotonic()
+
+
+def _sweep_jobs():
+    """
+    Forget jobs that finished more than `JOB_TTL` seconds ago.
+    """
+    cutoff = time.monotonic() - JOB_TTL
+    for job_id, finished in list(_JOB_FINISHED.items()):
+        if finished < cutoff:
+            _JOBS.pop(job_id, None)
+            _JOB_FINISHED.pop(job_id, None)
+
+
 @app.route("/annotate", methods=["POST"])
 def annotate_data():
     """
-    Validate and annotate uploaded variant data, then render the annotated
-    table.
+    Start validating and annotating the uploaded variant data.
 
     Workflow
     --------
-    1. Read the validated input CSV from the data directory.
-    2. Run validation.
-    3. Run annotation.
-    4. Build an HTML table of annotated data.
-    5. Render the checkbox view for downstream filtering.
+    1. Submit validation and annotation of the input CSV as a background job.
+    2. Redirect to the job's result page, which waits for it to finish.
 
     Returns
     -------
-    str
-        Rendered HTML for the annotation / filter selection page.
+    werkzeug.wrappers.response.Response
+        Redirect response to the annotation result route.
     """
 
-    data_dir = Path(__file__).resolve().parent.parent.parent / "data"
+    data_dir = app.config["DATA_DIR"]
     input_path = data_dir / "input_data.csv"
     validator_path = data_dir / "validated_data.csv"
-    anno_path = data_dir / "anno_data.csv"
 
-    # VALIDATE DATA
-    anno._validate(input_path, validator_path)
-    logger.info("Validator script run sucessfully")
+    # Forget old jobs whose results were never collected
+    _sweep_jobs()
+
+    # VALIDATE AND ANNOTATE DATA IN THE BACKGROUND
+    job_id = uuid.uuid4().hex
+    future = _PIPELINE_EXECUTOR.submit(
+        _annotation_job, _refresh_count, input_path, validator_path
+    )
+    _JOBS[job_id] = future
+    future.add_done_callback(functools.partial(_job_finished, job_id))
+    logger.info("Annotation job %s started", job_id)
+
+    return redirect(url_for("annotation_result", job_id=job_id))
+
 
-    # ANNOTATE DATA
-    anno._annotate(validator_path)
-    logger.info("Annotator script run sucessfully")
+@app.route("/status/<job_id>")
+def annotation_status(job_id):
+    """
+    Report the state of a background annotation job.
+
+    Parameters
+    ----------
+    job_id : str
+        ID returned when the job was started.
+
+    Returns
+    -------
+    flask.Response
+        JSON object whose 'status' is one of 'running', 'done', 'failed'
+        or 'unknown'.
+    """
+
+    future = _JOBS.get(job_id)
+
+    if future is None:
+        status = "unknown"
+    elif not future.done():
+        status = "running"
+    elif future.exception() is not None:
+        status = "failed"
+    else:
+        status = "done"
+
+    return jsonify(status=status)
+
+
+@app.route("/annotate/<job_id>")
+def annotation_result(job_id):
+    """
+    Render the result of a background annotation job.
+
+    Workflow
+    --------
+    1. Show a waiting page that polls the job status while it is running.
+    2. Re-raise any error from validation or annotation.
+    3. Redirect to the annotated data.
+
+    Parameters
+    ----------
+    job_id : str
+        ID returned when the job was started.
+
+    Returns
+    -------
+    str or werkzeug.wrappers.response.Response
+        Rendered HTML for the waiting page, or a redirect to the annotated
+        data route (or to the upload route for an unknown job).
+    """
+
+    future = _JOBS.get(job_id)
+
+    if future is None:
+        flash("Annotation job not found, please annotate again.", "warning")
+        return redirect(url_for("upload"))
+
+    if not future.done():
+        return flask_utils.render_static_template(
+            flask_utils.ANNO_WAIT_TEMPLATE,
+            status_url=url_for("annotation_status", job_id=job_id),
+        )
+
+    # The job is finished, so raise its error (if any) and forget it. Two
+    # requests for the same job may both get here
+    _JOBS.pop(job_id, None)
+    _JOB_FINISHED.pop(job_id, None)
+    future.result()
+
+    return redirect(url_for("annotated_data"))
+
+
+@app.route("/annotated")
+def annotated_data():
+    """
+    Show one page of the annotated variant data.
+
+    Workflow
+    --------
+    1. Build an HTML table of the requested page of annotated data.
+    2. Render the checkbox view for downstream filtering.
+
+    Query parameters
+    ----------------
+    page : int, optional
+        Zero-based page number, defaults to the first page.
+
+    Returns
+    -------
+    str
+        Rendered HTML for the annotation / filter selection page.
+    """
+
+    data_dir = app.config["DATA_DIR"]
+    anno_path = data_dir / "anno_data.csv"
+    page = request.args.get("page", 0, type=int)
 
     # BUILD HTML TABLE
-    df, table_html = anno._build_table(anno_path)
-    logger.info("Annotated table built")
+    # Only the requested page is rendered. The parsed CSV is cached, so
+    # moving between pages doesn't read the file again
+    df, table_html = anno._build_table(anno_path, page=page)
+    logger.info("Annotated table page %d built", page)
 
     # SHOW ANNOTATED DATA AND CHECKBOXES FOR FILTERING
     return flask_utils.show_checkboxes(df, table_html)
@@ -215,7 +450,7 @@ def annotate_data():
 ############################################################################
 
 
-@app.route("/filter", methods=["POST"])
+@app.route("/filter", methods=["GET", "POST"])
 def filter_data():
     """
     Filter annotated variant data (e.g. by patient ID) and render results.
@@ -225,7 +460,15 @@ def filter_data():
     1. Load annotated data from CSV.
     2. Apply filters based on form input.
     3. Persist filtered data.
-    4. Render a page showing both original and filtered tables.
+    4. Render a page showing one page of the filtered table.
+
+    Query parameters
+    ----------------
+    page : int, optional
+        Zero-based page number, defaults to the first page.
+    patient_id : str, optional
+        Selected Patient_ID, repeated for each selection. Used by the page
+        links, which request the filter page with GET.
 
     Returns
     -------
@@ -233,19 +476,26 @@ def filter_data():
         Rendered HTML for the filtered results page.
     """
 
-    data_dir = Path(__file__).resolve().parent.parent.parent / "data"
+    data_dir = app.config["DATA_DIR"]
     anno_path = data_dir / "anno_data.csv"
     filtered_path = data_dir / "filtered_data.csv"
+    page = request.args.get("page", 0, type=int)
 
     # CREATE PANDAS DATAFRAME
     df = filters._read_anno_data(anno_path)
     logger.info("Pre-filtered dataframe created")
 
+    # Checkbox values, computed once for both filtering and the page
+    patient_ids = flask_utils.get_patient_ids(df)
+
     filtered_df, selected_ids, applied_text = filters._filter_df(
-        df, filtered_path
+        df, patient_ids, filtered_path
     )
     logger.info("Filtered dataframe created")
 
+    # The page only needs the filtered rows
+    del df
+
     return filters._show_filter_page(
-        df, filtered_df, selected_ids, applied_text
+        filtered_df, patient_ids, selected_ids, applied_text, page=page
     )
@@ -13,12 +13,18 @@ from parkVar.utils.logger_config import logger
 # versions
 GENOME_BUILD = "GRCh38"
 
+# Text columns of the accumulated input CSV. Giving their types up front
+# saves pandas inferring them and keeps IDs such as "007" or chromosome "X"
+# as written when the CSV is read back
+INPUT_DTYPES = {"Patient_ID": str, "#CHROM": str, "REF": str, "ALT": str}
+
 
 def setup_df(input_csv_path: str, vv_values: dict) -> pd.DataFrame:
     """Reads a CSV file containing genomic variants and initialises a DataFrame
     with additional columns for Variant Validator values.
 
-    This function reads the input CSV file into a DataFrame, adds a
+    This function reads the input CSV file into a DataFrame, with the known
+    text columns given in INPUT_DTYPES read as strings, adds a
     'genome_build' column with a default value, and initializes additional
     columns for values to be filled in from the Variant Validator API.
 
@@ -38,8 +44,8 @@ def setup_df(input_csv_path: str, vv_values: dict) -> pd.DataFrame:
         columns initialized for Variant Validator values.
 
     """
-    logger.info(f"Reading in variants from {input_csv_path}")
-    variant_df = pd.read_csv(input_csv_path)
+    logger.info("Reading in variants from %s", input_csv_path)
+    variant_df = pd.read_csv(input_csv_path, dtype=INPUT_DTYPES)
 
     # Initialise new columns for desired values to be filled in from the
     # Variant Validator API response
@@ -116,8 +122,9 @@ def call_variant_validator(url: str) -> dict:
         # Log and raise an error for any status code that is not 200, as this
         # is the only status code we expect for a successful request
         logger.error(
-            f"Error: Received status code {response.status_code} - "
-            f"{response.text}"
+            "Error: Received status code %s - %s",
+            response.status_code,
+            response.text,
         )
 
         raise requests.exceptions.HTTPError(
@@ -127,7 +134,7 @@ def call_variant_validator(url: str) -> dict:
     # Catch, log and raise any non status code related errors that would be
     # missed in the above error handling
     except requests.exceptions.RequestException as e:
-        logger.error(f"Request failed: {e}")
+        logger.error("Request failed: %s", e)
         raise e
 
 
@@ -237,16 +244,18 @@ def parse_vv_response(
 
         else:
             logger.warning(
-                f"Variant at row {index} has >1 MANE Select transcript ID "
+                "Variant at row %s has >1 MANE Select transcript ID "
                 "returned, expected only 1 MANE Select transcript, "
-                "no further variant information will be gathered."
+                "no further variant information will be gathered.",
+                index,
             )
             return
 
     else:
         logger.warning(
-            f"Variant at row {index} could not be validated: "
-            f"{vv_response['genomic_variant_error']}"
+            "Variant at row %s could not be validated: %s",
+            index,
+            vv_response["genomic_variant_error"],
         )
         return
 
@@ -288,7 +297,9 @@ def update_df_with_parsed_vv_values(
             df.at[index, key] = value
         else:
             logger.warning(
-                f"Variant at row {index} has no associated {key} value in VV."
+                "Variant at row %s has no associated %s value in VV.",
+                index,
+                key,
             )
 
 
@@ -350,7 +361,7 @@ def validate_variants(
     variant_df.to_csv(output_csv_path, index=False)
 
     logger.info(
-        f"Variant validation complete. Output saved to {output_csv_path}."
+        "Variant validation complete. Output saved to %s.", output_csv_path
     )
 
 
@@ -14,7 +14,7 @@ Notes:
 """
 
 
-import pandas as pd
+import os
 
 from parkVar.modules.clinvar_annotator import process_variants_file
 from parkVar.modules.validate import validate_variants
@@ -42,7 +42,7 @@ def _validate(input_path, validator_path):
     """
 
     # Check input file exists
-    if not input_path.exists():
+    if not os.path.exists(input_path):
         raise flask_utils.MissingFileError(
             context="input_data.csv",
             original_exception=FileNotFoundError(
@@ -77,7 +77,7 @@ def _annotate(validator_path):
     """
 
     # Check validated_data.csv exists
-    if not validator_path.exists():
+    if not os.path.exists(validator_path):
         raise flask_utils.MissingFileError(
             context="validated_data.csv",
             original_exception=FileNotFoundError(
@@ -94,7 +94,36 @@ def _annotate(validator_path):
         )
 
 
-def _build_table(anno_path):
+def _run_pipeline(input_path, validator_path):
+    """
+    Validate and then annotate the input variant file.
+
+    Used as the background job started by the annotate route.
+
+    Parameters
+    ----------
+    input_path : pathlib.Path
+        Path to the input CSV file containing raw variant data.
+    validator_path : pathlib.Path
+        Path where the validated CSV should be written. The annotated CSV is
+        written to the same directory.
+
+    Raises
+    ------
+    flask_utils.MissingFileError
+        If an input file does not exist.
+    flask_utils.ProcessError
+        If validation or annotation fails.
+    """
+
+    _validate(input_path, validator_path)
+    logger.info("Validator script run sucessfully")
+
+    _annotate(validator_path)
+    logger.info("Annotator script run sucessfully")
+
+
+def _build_table(anno_path, page=None):
     """
     Load an annotated CSV and build an HTML table.
 
@@ -102,6 +131,9 @@ def _build_table(anno_path):
     ----------
     anno_path : pathlib.Path
         Path to the annotated CSV file.
+    page : int, optional
+        Only display this page of rows (see `flask_utils.create_table_page`).
+        All rows are displayed if not given.
 
     Returns
     -------
@@ -118,8 +150,11 @@ def _build_table(anno_path):
         If the CSV cannot be read into a DataFrame.
     """
 
-    # Check validated_data.csv exists
-    if not anno_path.exists():
+    # Check anno_data.csv exists, keeping the stat result to record which
+    # version of the file the data came from
+    try:
+        anno_stat = os.stat(anno_path)
+    except FileNotFoundError:
         raise flask_utils.MissingFileError(
             context="anno_data.csv",
             original_exception=FileNotFoundError(
@@ -127,17 +162,20 @@ def _build_table(anno_path):
             ),
         )
 
-    # Read csv to pandas dataframe
+    # Read csv to pandas dataframe, reusing it while the file is unchanged
     try:
-        df = pd.read_csv(anno_path)
+        df = flask_utils.read_anno_csv(anno_path, anno_stat)
     except Exception as e:
         raise flask_utils.CSVReadError(
             context="anno_data.csv", original_exception=e
         )
 
-    logger.info(f"Loaded annotated data with {len(df)} rows")
+    logger.info("Loaded annotated data with %d rows", len(df))
 
     # Build HTML table
-    table_html = flask_utils.create_table(df)
+    if page is None:
+        table_html = flask_utils.create_table(df)
+    else:
+        table_html = flask_utils.create_table_page(df, page)
 
     return df, table_html
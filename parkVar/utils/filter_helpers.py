@@ -15,12 +15,55 @@ Notes:
 """
 
 
-import pandas as pd
-from flask import render_template_string, request
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import request
 
 from parkVar.utils import flask_utils
 from parkVar.utils.logger_config import logger
 
+# Selection and source data last written to each filtered CSV path, used to
+# skip rewriting the file when the user re-submits the same filter
+_LAST_WRITTEN = {}
+
+# Filtered CSVs are written in the background so the filter page doesn't
+# wait on disk. A single worker keeps writes to the same path in order.
+_IO_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Most recent write queued for each filtered CSV path
+_PENDING_WRITES = {}
+
+
+def _write_filtered_csv(filtered_df, filtered_path):
+    """
+    Write the filtered data to CSV, logging rather than raising on failure.
+
+    Runs on the background writer thread.
+
+    Parameters
+    ----------
+    filtered_df : pandas.DataFrame
+        The filtered dataframe.
+    filtered_path : pathlib.Path
+        Path where the filtered CSV should be written.
+    """
+    try:
+        filtered_df.to_csv(filtered_path, index=False)
+    except Exception as e:
+        # Allow the next request to try again
+        _LAST_WRITTEN.pop(str(filtered_path), None)
+        logger.error("Failed to write %s: %s", filtered_path, e)
+
+
+def _wait_for_writes():
+    """
+    Block until all queued filtered CSV writes have finished.
+
+    Call this before reading or deleting files in the data directory.
+    """
+    wait(list(_PENDING_WRITES.values()))
+
 
 def _read_anno_data(anno_path):
     """
@@ -42,9 +85,11 @@ def _read_anno_data(anno_path):
         If the CSV cannot be read.
     """
 
-    # Create pandas dataframe from csv
+    # Create pandas dataframe from csv. The parsed data are reused while the
+    # file is unchanged, and Patient_ID is already a categorical
     try:
-        df = pd.read_csv(anno_path)
+        anno_stat = os.stat(anno_path)
+        df = flask_utils.read_anno_csv(anno_path, anno_stat)
     except Exception as e:
         raise flask_utils.CSVReadError(
             context="anno_data.csv", original_exception=e
@@ -53,16 +98,21 @@ def _read_anno_data(anno_path):
     return df
 
 
-def _filter_df(df, filtered_path):
+def _filter_df(df, patient_ids, filtered_path):
     """
-    Filter a DataFrame by selected Patient_ID values from a Flask form.
+    Filter a DataFrame by selected Patient_ID values from the request.
 
     Parameters
     ----------
     df : pandas.DataFrame
-        The pre-annotated dataframe.
+        The pre-annotated dataframe. Its Patient_ID column is converted to a
+        string categorical in place if it isn't one already.
+    patient_ids : list[str]
+        All Patient_ID values in `df`, from `flask_utils.get_patient_ids`.
     filtered_path : pathlib.Path
-        Path where the filtered CSV should be written.
+        Path where the filtered CSV should be written. The write runs in the
+        background (see `_wait_for_writes`) and is skipped if the same
+        selection of the same source data was last written there.
 
     Returns
     -------
@@ -85,59 +135,92 @@ def _filter_df(df, filtered_path):
             context="Patient_ID", original_exception=KeyError("Patient_ID")
         )
 
-    # List of selected patient IDs from the form
-    selected_ids = request.form.getlist("patient_id")
+    # Convert Patient_ID once and store it back on the frame for the mask
+    # below. Frames from _read_anno_data are already converted.
+    df["Patient_ID"] = flask_utils.patient_id_category(df["Patient_ID"])
+
+    # List of selected patient IDs from the form, or from the query string
+    # when moving between pages of the results
+    selected_ids = request.values.getlist("patient_id")
 
     # Apply filter
-    if selected_ids:
-        filtered_df = df[df["Patient_ID"].astype(str).isin(selected_ids)]
-        logger.info(f"Filter applied to Patient_ID(s): {selected_ids}")
+    if selected_ids and set(selected_ids) >= set(patient_ids):
+        # Every patient is ticked, so there is nothing to filter out
+        filtered_df = df
+        logger.info("No filter applied (all Patient_IDs selected)")
+        applied_text = "All patients selected."
+    elif selected_ids:
+        filtered_df = df[df["Patient_ID"].isin(selected_ids)]
+        logger.info("Filter applied to Patient_ID(s): %s", selected_ids)
         applied_text = f"Filtered by: {', '.join(selected_ids)}"
     else:
-        # No boxes ticked = show everything
-        filtered_df = df.copy()
+        # No boxes ticked = show everything. Nothing downstream modifies the
+        # frame, so it doesn't need copying
+        filtered_df = df
         logger.info("No filter applied (no Patient_ID selected)")
         applied_text = "No filter selected. Showing all rows."
 
-    # Write filtered data to CSV
-    filtered_df.to_csv(filtered_path, index=False)
+    # Write filtered data to CSV, unless this selection of the same source
+    # data has already been written. Selecting everything writes the same
+    # data as selecting nothing.
+    source = df.attrs.get("source_mtime_ns")
+    write_key = (
+        frozenset(selected_ids) if filtered_df is not df else None,
+        source,
+    )
+    if (
+        source is not None
+        and _LAST_WRITTEN.get(str(filtered_path)) == write_key
+        and filtered_path.exists()
+    ):
+        logger.info("Filter unchanged. Skipping write of filtered data.")
+    else:
+        _LAST_WRITTEN[str(filtered_path)] = write_key
+        _PENDING_WRITES[str(filtered_path)] = _IO_EXECUTOR.submit(
+            _write_filtered_csv, filtered_df, filtered_path
+        )
 
     return filtered_df, selected_ids, applied_text
 
 
-def _show_filter_page(df, filtered_df, selected_ids, applied_text):
+def _show_filter_page(
+    filtered_df, patient_ids, selected_ids, applied_text, page=0
+):
     """
     Render a filter results page showing checkboxes and the filtered table.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The full annotated DataFrame.
     filtered_df : pandas.DataFrame
         The filtered DataFrame.
+    patient_ids : list[str]
+        All Patient_ID values, shown as checkboxes.
     selected_ids : list[str]
         List of selected Patient_ID values.
     applied_text : str
         Text describing the applied filter.
+    page : int, optional
+        Page of the filtered table to display (see
+        `flask_utils.create_table_page`). Defaults to the first page.
 
     Returns
     -------
     str
-        Rendered HTML containing the checkbox form and filtered table.
+        Rendered HTML containing the checkbox form and one page of the
+        filtered table.
     """
 
-    # Rebuild checkbox values so the page can re-render them
-    patient_ids = sorted(
-        df["Patient_ID"].astype(str).dropna().unique().tolist()
+    # Only the requested page of the filtered frame is rendered, as on the
+    # annotated data page. The page links keep the selection
+    table_html = flask_utils.create_table_page(
+        filtered_df, page, params={"patient_id": selected_ids}
     )
 
-    # Build the table HTML for the filtered frame
-    table_html = flask_utils.create_table(filtered_df)
-
-    return render_template_string(
+    return flask_utils.render_static_template(
         flask_utils.ANNO_TEMPLATE,
         applied_text=applied_text,
         table=table_html,
-        patient_ids=patient_ids,
-        selected_ids=selected_ids,
+        checked=flask_utils.checkbox_states(
+            patient_ids, frozenset(selected_ids)
+        ),
     )
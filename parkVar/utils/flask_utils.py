@@ -6,16 +6,29 @@ This module provides:
 - custom exception classes that integrate with the logging system
 - helper functions for rendering DataFrames as HTML tables
   and showing filter checkboxes for Patient_ID values
+- cached loading of annotated CSVs
 
 Author: Emily Amies
 Group: 4
 
 Notes:
-- Templates are rendered with `render_template_string`.
-- Exceptions log their messages on initialisation using the shared logger.
+- Templates are compiled once at import with a module-level Jinja
+  environment, which keeps a bytecode cache in 'cache/jinja', and rendered
+  with `render_static_template`.
+- Exceptions log their messages on initialisation using the shared logger,
+  with the message formatted lazily by logging.
 """
 
-from flask import render_template_string
+import functools
+import html
+from pathlib import Path
+from urllib.parse import urlencode
+
+import jinja2
+import numpy as np
+import pandas as pd
+from flask import get_flashed_messages
+from pandas.io.formats.format import DataFrameFormatter
 
 from parkVar.utils.logger_config import logger
 
@@ -25,18 +38,10 @@ from parkVar.utils.logger_config import logger
 
 # ALL HTML TEMPLATES IN THIS DOCUMENT WERE GENERATED USING CHATGPT
 
-# Base template - includes code for flashed messsages and the "refresh
-# sessipon" button
+# Base template - includes a slot for flashed messsages and the "refresh
+# sessipon" button. The flashed messages are rendered by `_render_flashes`
 UPLOAD_PAGE = """
-        {% with messages = get_flashed_messages(with_categories=true) %}
-        {% if messages %}
-            <ul class="flashes">
-            {% for category, message in messages %}
-                <li class="{{ category }}">{{ message }}</li>
-            {% endfor %}
-            </ul>
-        {% endif %}
-        {% endwith %}
+        {{ flashes|safe }}
 
         <style>
             .warning {
@@ -107,6 +112,7 @@ UPLOAD_ANNO_TEMPLATE = (
         </script>
 
         <h3>Uploaded data</h3>
+        {{ table|safe }}
         """
 )
 
@@ -117,12 +123,12 @@ ANNO_TEMPLATE = (
 
         <h3>Filter by Patient_ID</h3>
         <form action='/filter' method='post' style='margin-bottom: 1rem;'>
-            {% for pid in patient_ids %}
+            {% for pid, is_checked in checked.items() %}
                 <label>
                     <input type='checkbox'
                            name='patient_id'
                            value='{{ pid }}'
-                           {% if pid in selected_ids %}checked{% endif %}>
+                           {% if is_checked %}checked{% endif %}>
                     {{ pid }}
                 </label><br>
             {% endfor %}
@@ -135,17 +141,56 @@ ANNO_TEMPLATE = (
         """
 )
 
+# Shown while validation and annotation run in the background. Polls the
+# job's status URL, retrying after failed requests, and reloads the page
+# once the job has finished.
+ANNO_WAIT_TEMPLATE = (
+    UPLOAD_PAGE
+    + """
+        <p style='color:red; margin-top:1rem;'>
+            Annotating variants, this may take a few seconds...
+        </p>
+
+        <noscript>
+            <meta http-equiv='refresh' content='2'>
+        </noscript>
+
+        <script>
+        (function poll() {
+            fetch('{{ status_url }}')
+                .then(function (resp) {
+                    if (!resp.ok) {
+                        throw new Error(resp.statusText);
+                    }
+                    return resp.json();
+                })
+                .then(function (data) {
+                    if (data.status === 'running') {
+                        setTimeout(poll, 1000);
+                    } else {
+                        window.location.reload();
+                    }
+                })
+                .catch(function () {
+                    // The server couldn't be reached, so try again later
+                    setTimeout(poll, 5000);
+                });
+        })();
+        </script>
+        """
+)
+
 CHECKBOX_TEMPLATE = (
     UPLOAD_PAGE
     + """
         <h3>Filter by Patient_ID</h3>
         <form action='/filter' method='post' style='margin-top: 1rem;'>
-          {% for pid in patient_ids %}
+          {% for pid, is_checked in checked.items() %}
             <label>
               <input type='checkbox'
                      name='patient_id'
                      value='{{ pid }}'
-                     {% if pid in selected_ids %}checked{% endif %}>
+                     {% if is_checked %}checked{% endif %}>
               {{ pid }}
             </label><br>
           {% endfor %}
@@ -200,6 +245,96 @@ ERROR_TEMPLATE = """
 </html>
 """
 
+# Placeholder for the flashed messages HTML in UPLOAD_PAGE
+_FLASHES_SLOT = "{{ flashes|safe }}"
+
+
+def _template_parts(templates):
+    """
+    Split template sources into the parts that are compiled separately.
+
+    The shared UPLOAD_PAGE prefix is removed from every template, as it is
+    rendered separately by `_render_upload_page`.
+
+    Parameters
+    ----------
+    templates : dict[str, str]
+        Template sources by name.
+
+    Returns
+    -------
+    dict[str, str]
+        Part sources by name: UPLOAD_PAGE as 'upload_page.html' and each
+        template under its own name.
+    """
+    sources = {"upload_page.html": UPLOAD_PAGE}
+    for name, source in templates.items():
+        sources[name] = source.removeprefix(UPLOAD_PAGE)
+    return sources
+
+
+# Template part sources by name
+_TEMPLATE_SOURCES = _template_parts(
+    {
+        "upload.html": UPLOAD_TEMPLATE,
+        "upload_anno.html": UPLOAD_ANNO_TEMPLATE,
+        "anno.html": ANNO_TEMPLATE,
+        "anno_wait.html": ANNO_WAIT_TEMPLATE,
+        "checkbox.html": CHECKBOX_TEMPLATE,
+        "error.html": ERROR_TEMPLATE,
+    }
+)
+
+# Compiled templates are stored in the project's cache directory, next to
+# the ClinVar cache, so other worker processes and restarts load them
+# instead of compiling them again. The directory is mounted as a writable
+# volume in docker-compose.yml
+TEMPLATE_CACHE_DIR = (
+    Path(__file__).resolve().parent.parent.parent / "cache" / "jinja"
+)
+
+
+def _template_bytecode_cache(directory):
+    """
+    Return a bytecode cache stored in `directory`, creating it if needed.
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Directory for the compiled template files.
+
+    Returns
+    -------
+    jinja2.FileSystemBytecodeCache or None
+        The cache, or None if the directory can't be created, in which case
+        templates are just compiled in memory.
+    """
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        logger.warning("Template cache unavailable: %s", exc)
+        return None
+    return jinja2.FileSystemBytecodeCache(str(directory))
+
+
+# Environment used to compile the templates above. Autoescaping matches
+# Flask's behaviour for templates rendered from strings.
+_ENV = jinja2.Environment(
+    loader=jinja2.DictLoader(_TEMPLATE_SOURCES),
+    autoescape=True,
+    bytecode_cache=_template_bytecode_cache(TEMPLATE_CACHE_DIR),
+)
+
+# Compiled Jinja templates, keyed by their source string
+_COMPILED_TEMPLATES = {
+    source: _ENV.get_template(name)
+    for name, source in _TEMPLATE_SOURCES.items()
+}
+
+# UPLOAD_PAGE with no flashed messages, which is what most requests show
+_EMPTY_UPLOAD_PAGE = _COMPILED_TEMPLATES[UPLOAD_PAGE].render(flashes="")
+
+
 ########################################################################
 # Custom Exceptions
 ########################################################################
@@ -212,32 +347,45 @@ class AppError(Exception):
 
     All custom exceptions in this module inherit from AppError to allow
     consistent catching and handling at the Flask app level.
-    """
 
-    pass
-
-class CSVReadError(AppError):
-    """
-    Exception raised when reading a CSV file fails.
+    Subclasses set `message` to a %-style format for the context. The full
+    message is only built when the exception is converted to a string, and
+    logging formats it lazily.
 
     Parameters
     ----------
     context : str
-        Description of what was being read (e.g. filename).
+        Description of what failed (e.g. filename or step name).
     original_exception : Exception
         The underlying exception that triggered this error.
     """
 
+    message = "%s"
+
     def __init__(self, context, original_exception):
+        super().__init__(context, original_exception)
         self.context = context
         self.original_exception = original_exception
 
-        message = f"Failure reading: {context}"
-        message += f": {original_exception}"
+        logger.error(self.message + ": %s", context, original_exception)
 
-        super().__init__(message)
+    def __str__(self):
+        return f"{self.message % self.context}: {self.original_exception}"
+
+
+class CSVReadError(AppError):
+    """
+    Exception raised when reading a CSV file fails.
+
+    Parameters
+    ----------
+    context : str
+        Description of what was being read (e.g. filename).
+    original_exception : Exception
+        The underlying exception that triggered this error.
+    """
 
-        logger.error(message)
+    message = "Failure reading: %s"
 
 
 class MissingFileError(AppError):
@@ -252,16 +400,7 @@ class MissingFileError(AppError):
         The underlying exception that triggered this error.
     """
 
-    def __init__(self, context, original_exception):
-        self.context = context
-        self.original_exception = original_exception
-
-        message = f"Could not find: {context}"
-        message += f": {original_exception}"
-
-        super().__init__(message)
-
-        logger.error(message)
+    message = "Could not find: %s"
 
 
 class ProcessError(AppError):
@@ -276,16 +415,7 @@ class ProcessError(AppError):
         The underlying exception that triggered this error.
     """
 
-    def __init__(self, context, original_exception):
-        self.context = context
-        self.original_exception = original_exception
-
-        message = f"{context} step has failed"
-        message += f": {original_exception}"
-
-        super().__init__(message)
-
-        logger.error(message)
+    message = "%s step has failed"
 
 
 class MissingColumnError(AppError):
@@ -300,16 +430,7 @@ class MissingColumnError(AppError):
         The underlying exception that triggered this error.
     """
 
-    def __init__(self, context, original_exception):
-        self.context = context
-        self.original_exception = original_exception
-
-        message = f"{context} column is missing"
-        message += f": {original_exception}"
-
-        super().__init__(message)
-
-        logger.error(message)
+    message = "%s column is missing"
 
 
 ########################################################################
@@ -318,6 +439,284 @@ class MissingColumnError(AppError):
 
 # Functions that may be reused when expanding the project further
 
+# Rows shown per page of a paginated table
+TABLE_PAGE_SIZE = 200
+
+
+def optimise_dtypes(df, max_category_ratio=0.5):
+    """
+    Shrink the dtypes of a freshly loaded DataFrame in place.
+
+    `read_csv` stores integers as int64 and text as Python objects.
+    Integer columns are downcast to the smallest integer type that holds
+    their values, and text columns with few distinct values (e.g.
+    chromosome, classification) are stored as categoricals. This roughly
+    halves the memory used by an annotated table and speeds up later
+    column scans. Float columns are left alone so displayed values don't
+    change.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame to update.
+    max_category_ratio : float, optional
+        Text columns are made categorical when their number of distinct
+        values is at most this fraction of the number of rows.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The same DataFrame, for convenience.
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[col] = pd.to_numeric(series, downcast="integer")
+        elif (
+            series.dtype == object
+            and series.nunique() <= max_category_ratio * len(series)
+        ):
+            df[col] = series.astype("category")
+    return df
+
+
+def get_patient_ids(df):
+    """
+    Return the sorted unique Patient_ID values of a DataFrame as strings.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame containing a 'Patient_ID' column.
+
+    Returns
+    -------
+    list[str]
+        Sorted unique patient IDs, excluding missing values.
+
+    Raises
+    ------
+    MissingColumnError
+        If the 'Patient_ID' column is missing from the DataFrame.
+    """
+    if "Patient_ID" not in df.columns:
+        raise MissingColumnError(
+            context="Patient_ID", original_exception=KeyError("Patient_ID")
+        )
+
+    # Unique values are found on the original dtype, so only those are
+    # converted to strings and sorted. Categories are already unique
+    col = df["Patient_ID"]
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        uniq = col.cat.categories.to_numpy()
+    else:
+        uniq = pd.unique(col.dropna().to_numpy())
+    return np.sort(uniq.astype(str)).tolist()
+
+
+def _render_flashes():
+    """
+    Render the flashed messages for the current request as HTML.
+
+    Returns
+    -------
+    str
+        A `<ul class="flashes">` list with one item per message, or an
+        empty string when there are no messages.
+    """
+    messages = get_flashed_messages(with_categories=True)
+    if not messages:
+        return ""
+
+    escape = html.escape
+    items = "".join(
+        f'<li class="{escape(category)}">{escape(message)}</li>'
+        for category, message in messages
+    )
+    return f'<ul class="flashes">{items}</ul>'
+
+
+def _render_upload_page(flashes=None):
+    """
+    Render UPLOAD_PAGE, reusing the pre-rendered page when nothing is
+    flashed.
+
+    Parameters
+    ----------
+    flashes : str, optional
+        Flashed messages HTML. Rendered by `_render_flashes` if not given.
+
+    Returns
+    -------
+    str
+        Rendered HTML for UPLOAD_PAGE.
+    """
+    if flashes is None:
+        flashes = _render_flashes()
+    if not flashes:
+        return _EMPTY_UPLOAD_PAGE
+    return _COMPILED_TEMPLATES[UPLOAD_PAGE].render(flashes=flashes)
+
+
+@functools.lru_cache(maxsize=16)
+def _compile_template(source):
+    """
+    Compile a template source that isn't one of the module's templates.
+
+    Parameters
+    ----------
+    source : str
+        Template source.
+
+    Returns
+    -------
+    jinja2.Template
+        Compiled template. The most recently used sources are cached.
+    """
+    return _ENV.from_string(source)
+
+
+def render_static_template(source, **context):
+    """
+    Render one of the module's template strings without recompiling it.
+
+    `render_template_string` compiles its source on every call. The
+    templates in this module never change, so they are compiled once at
+    import and the compiled template is reused. Other sources are compiled
+    by `_compile_template`, which keeps only the most recently used ones.
+
+    A leading UPLOAD_PAGE is rendered by `_render_upload_page`, and the
+    rest of the template separately. Other templates with a
+    `{{ flashes|safe }}` slot are given the flashed messages rendered by
+    `_render_flashes`, unless `flashes` is passed.
+
+    Parameters
+    ----------
+    source : str
+        Template source, e.g. ANNO_TEMPLATE.
+    **context
+        Variables passed to the template.
+
+    Returns
+    -------
+    str
+        Rendered HTML.
+
+    Notes
+    -----
+    Templates using flashed messages must be rendered inside a request
+    context.
+    """
+    page = ""
+    if source.startswith(UPLOAD_PAGE):
+        page = _render_upload_page(context.get("flashes"))
+        source = source[len(UPLOAD_PAGE) :]
+
+    template = _COMPILED_TEMPLATES.get(source)
+    if template is None:
+        template = _compile_template(source)
+    if "flashes" not in context and _FLASHES_SLOT in source:
+        context["flashes"] = _render_flashes()
+    return page + template.render(**context)
+
+
+def patient_id_category(series):
+    """
+    Return a Patient_ID column as a string-valued categorical.
+
+    Patient IDs have low cardinality, so storing them as categories lets
+    `isin`/`unique` work on the integer codes instead of allocating a new
+    Python string per row on every request.
+
+    Parameters
+    ----------
+    series : pandas.Series
+        The Patient_ID column.
+
+    Returns
+    -------
+    pandas.Series
+        The same values as a categorical with string categories. Returned
+        unchanged if it is already categorical.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype("string").astype("category")
+
+
+# Text columns of an annotated CSV, from the input, validation and
+# annotation stages. Reading them as strings skips type inference and keeps
+# IDs as written, e.g. an OMIM ID in a column with gaps stays "123456"
+# rather than becoming the float 123456.0
+_ANNO_TEXT_COLUMNS = (
+    "Patient_ID",
+    "#CHROM",
+    "ID",
+    "REF",
+    "ALT",
+    "genome_build",
+    "g_hgvs",
+    "t_hgvs",
+    "hgnc_id",
+    "symbol",
+    "p_hgvs_tlc",
+    "clinvar_uid",
+    "classification",
+    "review_status_text",
+    "disease_name",
+    "disease_mim",
+)
+_ANNO_DTYPES = dict.fromkeys(_ANNO_TEXT_COLUMNS, str)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_anno_csv(path, mtime_ns, size):
+    """
+    Parse an annotated CSV. Cached per version of the file, see
+    `read_anno_csv`.
+    """
+    df = pd.read_csv(path, dtype=_ANNO_DTYPES)
+
+    # Store Patient_ID as a categorical once at load time (see
+    # patient_id_category)
+    if "Patient_ID" in df.columns:
+        df["Patient_ID"] = patient_id_category(df["Patient_ID"])
+
+    # Use compact dtypes for the remaining columns
+    optimise_dtypes(df)
+
+    df.attrs["source_mtime_ns"] = mtime_ns
+    return df
+
+
+def read_anno_csv(anno_path, anno_stat):
+    """
+    Load an annotated CSV, reusing the parsed data while the file is
+    unchanged.
+
+    The filter page is re-submitted many times against the same file, so
+    parsed DataFrames are cached against the file's path, modification
+    time and size. Any rewrite of the file gets a new entry.
+
+    Parameters
+    ----------
+    anno_path : pathlib.Path
+        Path to the annotated CSV file.
+    anno_stat : os.stat_result
+        Result of `os.stat(anno_path)`, taken by the caller.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A shallow copy of the cached DataFrame, so callers can replace
+        columns without changing the cache. Its `attrs` record the file's
+        modification time as 'source_mtime_ns'.
+    """
+    df = _load_anno_csv(
+        str(anno_path), anno_stat.st_mtime_ns, anno_stat.st_size
+    )
+    return df.copy(deep=False)
+
 
 def create_table(df):
     """
@@ -334,18 +733,164 @@ def create_table(df):
         Rendered HTML snippet showing the row count and table.
     """
 
-    table = render_template_string(
-        # Template for table
-        "<h3></h3><p>Rows: {{ n }}</p>{{ table|safe }}<hr>",
-        n=len(df),  # Number of rows
-        # Convert the pandas dataframe into simple HTML table
-        table=df.to_html(index=False),
+    return "".join(iter_table_html(df))
+
+
+def create_table_page(df, page, page_size=TABLE_PAGE_SIZE, params=None):
+    """
+    Render one page of a DataFrame as an HTML table.
+
+    Only the rows of the requested page are converted to HTML, so the cost
+    of a page doesn't grow with the size of the table. Links to the
+    previous and next pages are added above the table.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame to render.
+    page : int
+        Zero-based page number. Out of range values show the nearest page.
+    page_size : int, optional
+        Number of rows per page.
+    params : dict[str, list[str]], optional
+        Query parameters kept in the page links, e.g. the Patient_IDs
+        selected on the filter page.
+
+    Returns
+    -------
+    str
+        Rendered HTML snippet showing the row count, page links and table.
+    """
+
+    n_pages = max(1, -(-len(df) // page_size))
+    page = min(max(page, 0), n_pages - 1)
+    start = page * page_size
+
+    def link(target, text):
+        query = urlencode({**(params or {}), "page": target}, doseq=True)
+        return f"<a href='?{html.escape(query)}'>{text}</a>"
+
+    links = [f"Page {page + 1} of {n_pages}"]
+    if page > 0:
+        links.append(link(page - 1, "Previous"))
+    if page < n_pages - 1:
+        links.append(link(page + 1, "Next"))
+    nav = f"<p class='pages'>{' | '.join(links)}</p>"
+
+    chunks = iter_table_html(df, rows=slice(start, start + page_size))
+    row_count = next(chunks)
+    return row_count + nav + "".join(chunks)
+
+
+def _format_cells(formatter, df, i):
+    """
+    Return the escaped `<td>` cells for one DataFrame column.
+
+    Cells show the same text as `DataFrame.to_html`. Float columns and
+    columns with missing values are formatted with pandas' own formatter,
+    which picks one precision per column and shows missing values as
+    'NaN', 'None' or '<NA>'. Other values are formatted with `str`.
+
+    Parameters
+    ----------
+    formatter : pandas.io.formats.format.DataFrameFormatter
+        Formatter for `df`, as used by `DataFrame.to_html(index=False)`.
+    df : pandas.DataFrame
+        DataFrame being rendered.
+    i : int
+        Position of the column to format.
+
+    Returns
+    -------
+    list[str]
+        One `<td>` element per row.
+    """
+    series = df.iloc[:, i]
+    if pd.api.types.is_float_dtype(series.dtype) or series.hasnans:
+        values = (value.strip() for value in formatter.format_col(i))
+    else:
+        values = map(str, series.tolist())
+    escape = html.escape
+    return [f"<td>{escape(value)}</td>" for value in values]
+
+
+def iter_table_html(df, chunk_rows=2048, rows=None):
+    """
+    Yield the HTML produced by `create_table` in pieces.
+
+    The table is built directly from the column values rather than with
+    `DataFrame.to_html`, whose generic formatters dominate the cost of
+    large tables. Only float columns and columns with missing values are
+    formatted by pandas, so the cells show the same text. The rows are
+    joined `chunk_rows` at a time.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame to render.
+    chunk_rows : int, optional
+        Number of rows converted to HTML per chunk.
+    rows : slice, optional
+        Only render these rows. The row count still reports the whole
+        DataFrame. All rows are rendered if not given.
+
+    Yields
+    ------
+    str
+        Consecutive fragments of the HTML snippet.
+    """
+
+    yield f"<h3></h3><p>Rows: {len(df)}</p>"
+
+    # Table opening tag and header row, styled as `to_html` would
+    header = "".join(f"<th>{html.escape(str(col))}</th>" for col in df.columns)
+    yield (
+        '<table border="1" class="dataframe">\n<thead>\n'
+        f'<tr style="text-align: right;">{header}</tr>\n</thead>\n'
     )
-    return table
+
+    body = df if rows is None else df.iloc[rows]
+
+    # Cells are formatted a whole column at a time, so each column gets one
+    # float precision as it would in `to_html`
+    formatter = DataFrameFormatter(body, index=False)
+    columns = [
+        _format_cells(formatter, body, i) for i in range(len(body.columns))
+    ]
+
+    yield "<tbody>"
+    for start in range(0, len(body), chunk_rows):
+        chunk = [cells[start : start + chunk_rows] for cells in columns]
+        yield "\n".join(
+            "<tr>" + "".join(cells) + "</tr>" for cells in zip(*chunk)
+        )
+    yield "</tbody>\n</table><hr>"
+
+
+def checkbox_states(patient_ids, selected_ids=frozenset()):
+    """
+    Map each Patient_ID checkbox to whether it is checked.
+
+    The templates loop over this mapping, so each checkbox needs a single
+    lookup rather than a membership test inside Jinja.
+
+    Parameters
+    ----------
+    patient_ids : list[str]
+        All Patient_ID values, in display order.
+    selected_ids : frozenset[str], optional
+        Patient_ID values that should be checked.
+
+    Returns
+    -------
+    dict[str, bool]
+        Checked state for each Patient_ID, in display order.
+    """
+    return {pid: pid in selected_ids for pid in patient_ids}
 
 
 # Only used once so far, but can be altered to add additional checkboxes
-def show_checkboxes(df, table_html, selected_ids=None):
+def show_checkboxes(df, table_html, selected_ids=frozenset()):
     """
     Render a filter page with Patient_ID checkboxes and an HTML table.
 
@@ -355,7 +900,7 @@ def show_checkboxes(df, table_html, selected_ids=None):
         DataFrame-like object containing a 'Patient_ID' column.
     table_html : str
         HTML representation of the data table to display.
-    selected_ids : list, optional
+    selected_ids : frozenset[str], optional
         Patient_ID values that should be pre-selected.
 
     Returns
@@ -369,21 +914,11 @@ def show_checkboxes(df, table_html, selected_ids=None):
         If the 'Patient_ID' column is missing from the DataFrame.
     """
     # Get unique patient IDs for checkboxes
-    if "Patient_ID" in df.columns:
-        patient_ids = sorted(
-            df["Patient_ID"].astype(str).dropna().unique().tolist()
-        )
-    else:
-        raise MissingColumnError(
-            context="Patient_ID", original_exception=KeyError("Patient_ID")
-        )
-
-    selected_ids = set(selected_ids or [])
+    patient_ids = get_patient_ids(df)
 
-    return render_template_string(
+    return render_static_template(
         CHECKBOX_TEMPLATE,
         table=table_html,
-        patient_ids=patient_ids,
-        selected_ids=selected_ids,
+        checked=checkbox_states(patient_ids, frozenset(selected_ids)),
         show_upload=False,  # hide the upload UI on this page
     )
@@ -17,9 +17,50 @@ Notes:
 """
 
 import logging
+import time
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
+# Levels accepted by setup_logger
+_VALID_LEVELS = frozenset(
+    {
+        logging.CRITICAL,
+        logging.ERROR,
+        logging.WARNING,
+        logging.INFO,
+        logging.DEBUG,
+        logging.NOTSET,
+    }
+)
+
+
+class CachedFormatter(logging.Formatter):
+    """
+    Formatter that reuses the formatted timestamp within the same second.
+
+    `logging.Formatter.formatTime` calls `localtime` and `strftime` for every
+    record. Only the milliseconds change between records logged in the same
+    second, so the rest of the timestamp is kept and reused. Output matches
+    the default `asctime` format.
+    """
+
+    # (second, formatted timestamp) kept as one tuple so threads never
+    # see a second paired with another second's string
+    _cached = (None, "")
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return super().formatTime(record, datefmt)
+
+        sec = int(record.created)
+        cached_sec, asctime = self._cached
+        if sec != cached_sec:
+            asctime = time.strftime(
+                self.default_time_format, self.converter(sec)
+            )
+            self._cached = (sec, asctime)
+        return self.default_msec_format % (asctime, record.msecs)
+
 
 def setup_logger(
     name, file_level=10, stream_level=10, maxBytes=500000, backupCount=2
@@ -43,7 +84,8 @@ def setup_logger(
     Returns
     -------
     logging.Logger
-        Configured logger instance.
+        Configured logger instance. If the logger already has handlers it
+        is returned unchanged.
 
     Raises
     ------
@@ -54,15 +96,13 @@ def setup_logger(
     """
 
     # Check parameters
-    valid_levels = {50, 40, 30, 20, 10, 0}
-
     if not isinstance(name, str):
         raise TypeError("name must be a string")
 
     for level in (stream_level, file_level):
-        if level not in valid_levels:
+        if level not in _VALID_LEVELS:
             raise ValueError(
-                f"level must be one of {sorted(valid_levels)}, got {level}"
+                f"level must be one of {sorted(_VALID_LEVELS)}, got {level}"
             )
 
     if not isinstance(maxBytes, int) or maxBytes <= 0:
@@ -71,19 +111,33 @@ def setup_logger(
     if not isinstance(backupCount, int) or backupCount < 0:
         raise ValueError("backupCount must be a non-negative integer")
 
+    logger = logging.getLogger(name)
+
+    # Already configured (e.g. the module was imported again), so don't add
+    # a second set of handlers that would write every record twice
+    if logger.handlers:
+        return logger
+
     # Path to the logs directory
     log_dir = Path(__file__).resolve().parent.parent.parent / "logs"
     log_dir.mkdir(exist_ok=True)
     log_file = f"{log_dir}/{name}.log"
 
-    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    formatter = CachedFormatter("%(asctime)s [%(levelname)s] %(message)s")
 
-    logger = logging.getLogger(name)
-    logger.setLevel(file_level)
+    # The logger passes on anything either handler wants, so records below
+    # both levels are dropped before a LogRecord is built. Handler levels
+    # are only needed when the two levels differ. NOTSET (0) on the logger
+    # would fall back to the root logger's level, so it is only used when
+    # both handlers are NOTSET
+    set_levels = [lvl for lvl in (file_level, stream_level) if lvl]
+    logger.setLevel(min(set_levels, default=logging.NOTSET))
+    per_handler_levels = file_level != stream_level
 
     # Add stream handler
     stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(stream_level)
+    if per_handler_levels:
+        stream_handler.setLevel(stream_level)
     stream_handler.setFormatter(formatter)
     logger.addHandler(stream_handler)
 
@@ -93,7 +147,8 @@ def setup_logger(
         maxBytes=maxBytes,  # 500 KB
         backupCount=backupCount,
     )
-    file_handler.setLevel(file_level)
+    if per_handler_levels:
+        file_handler.setLevel(file_level)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
@@ -18,15 +18,32 @@ Notes:
 """
 
 
-import io
+import csv
+import os
+import re
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from flask import flash, render_template_string
+from flask import flash
 
 from parkVar.utils import flask_utils
 from parkVar.utils.logger_config import logger
 
+# A non-blank line of a tracking file, without surrounding whitespace
+_LINE_RE = re.compile(rb"\S(?:[^\r\n]*\S)?")
+
+# Columns replaced with a Patient_ID derived from the upload's filename
+_REPLACED_COLUMNS = frozenset({"Patient_ID", "ID"})
+
+# Known input VCF-style columns. Chromosomes are read as text so that
+# files containing 'X' or 'Y' do not leave the column with mixed types
+_INPUT_DTYPES = {"#CHROM": str, "REF": str, "ALT": str}
+
+# Entries per tracking file, stored with the file's modification time so
+# the file is only re-read after it changes
+_TRACKING_CACHE = {}
+
 
 def _upload_file(request):
     """
@@ -61,22 +78,45 @@ def _upload_file(request):
     if not file or file.filename == "":
         logger.warning("No file uploaded")
         flash("No file uploaded", "warning")
-        return render_template_string(flask_utils.UPLOAD_TEMPLATE), 400
+        return (
+            flask_utils.render_static_template(flask_utils.UPLOAD_TEMPLATE),
+            400,
+        )
     else:
-        logger.info(f"{file.filename} uploaded sucessfully")
+        logger.info("%s uploaded sucessfully", file.filename)
         return file
 
 
+def _keep_column(col):
+    """
+    Decide whether an uploaded column is read into the DataFrame.
+
+    Parameters
+    ----------
+    col : str
+        Column name from the uploaded CSV header.
+
+    Returns
+    -------
+    bool
+        False for existing Patient_ID and ID columns, True otherwise.
+    """
+
+    if col in _REPLACED_COLUMNS:
+        logger.info("%s column exists. Deleting column.", col)
+        return False
+    return True
+
+
 def _create_pandas_dataframe(file):
     """
     Convert an uploaded CSV file into a pandas DataFrame and normalise columns.
 
     Steps
     -----
-    - Decode the uploaded bytes as UTF-8.
-    - Read into a DataFrame using pandas.
-    - Set a Patient_ID column based on the filename (stem).
-    - Drop any existing Patient_ID or ID columns to avoid duplication.
+    - Read the uploaded bytes as UTF-8 into a DataFrame using pandas,
+      skipping any existing Patient_ID or ID columns to avoid duplication.
+    - Set a categorical Patient_ID column based on the filename (stem).
 
     Parameters
     ----------
@@ -96,34 +136,151 @@ def _create_pandas_dataframe(file):
 
     # Convert file object to a pandas dataframe
     try:
-        text = file.read().decode("utf-8")
-        # io.StringIO - pandas usually expects a file on disk. When a file is
-        # read using a form, it is only raw bytes in memory. StringIO creates
-        # an in-memory file-object that acts like a normal file
-        df = pd.read_csv(io.StringIO(text))
+        # pandas parses the upload's byte stream directly, so the file is
+        # never held in memory as one large decoded string. Uploads from a
+        # form are werkzeug FileStorage objects, which wrap the stream.
+        # Rewind first in case the stream has already been read
+        stream = getattr(file, "stream", file)
+        stream.seek(0)
+        # Existing Patient_ID and ID columns are never parsed
+        df = pd.read_csv(
+            stream,
+            encoding="utf-8",
+            engine="c",
+            dtype=_INPUT_DTYPES,
+            usecols=_keep_column,
+        )
     except Exception as e:
         raise flask_utils.CSVReadError(
             context=file.filename, original_exception=e
         )
 
-    # Add patient ID as first column
+    # Add patient ID as first column. Every row has the same value, so it is
+    # stored as a one-category categorical rather than N copies of a string
     patient_id = Path(file.filename).stem  # strips .csv
-    if "Patient_ID" in df.columns:
-        df = df.drop(columns=["Patient_ID"])
-        logger.info("Patient_ID column exists. Deleting column.")
-    df.insert(0, "Patient_ID", patient_id)
-
-    # Remove ID column
-    if "ID" in df.columns:
-        df = df.drop(columns=["ID"])
-        logger.info("ID column exists. Deleting column.")
+    df.insert(
+        0,
+        "Patient_ID",
+        pd.Categorical.from_codes(
+            np.zeros(len(df), dtype="int8"), categories=[patient_id]
+        ),
+    )
 
     return df
 
 
+def _load_known(tracking_file):
+    """
+    Return the entries recorded in a tracking file.
+
+    The entries are cached against the file's modification time, so
+    repeated uploads only read the file again after it has changed.
+
+    Parameters
+    ----------
+    tracking_file : pathlib.Path
+        Path to 'uploaded_files.txt'.
+
+    Returns
+    -------
+    frozenset[str]
+        The recorded entries, empty if the file does not exist.
+    """
+
+    try:
+        mtime_ns = tracking_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        _TRACKING_CACHE.pop(tracking_file, None)
+        return frozenset()
+
+    cached = _TRACKING_CACHE.get(tracking_file)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    # Find the stripped non-blank lines of the raw bytes in one regex pass
+    # and decode only those. Lines are decoded as UTF-8, as uploaded
+    # filenames are not limited to ASCII
+    known = frozenset(
+        line.decode("utf-8")
+        for line in _LINE_RE.findall(tracking_file.read_bytes())
+    )
+    _TRACKING_CACHE[tracking_file] = (mtime_ns, known)
+    return known
+
+
+def _is_duplicate(entry, known):
+    """
+    Return whether an entry is already recorded.
+
+    Parameters
+    ----------
+    entry : str
+        Filename of an upload.
+    known : frozenset[str]
+        Entries already recorded, from `_load_known`.
+
+    Returns
+    -------
+    bool
+        True if the entry has been recorded before.
+    """
+    return entry in known
+
+
+def _add_to_tracking_file(tracking_file, entry):
+    """
+    Append an entry to a tracking file and keep the cache in step.
+
+    Parameters
+    ----------
+    tracking_file : pathlib.Path
+        Path to the tracking file.
+    entry : str
+        Entry to add.
+    """
+
+    known = _load_known(tracking_file)
+    if _is_duplicate(entry, known):
+        return
+
+    # Append a single line rather than rewriting the whole file. Every
+    # line ends in a newline, so the next entry starts on its own line
+    with open(tracking_file, "a", encoding="utf-8") as f:
+        f.write(f"{entry}\n")
+        # Take the new modification time from the open file, rather than
+        # looking the path up again
+        f.flush()
+        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+
+    _TRACKING_CACHE[tracking_file] = (mtime_ns, known | {entry})
+
+
+def _record_upload(data_dir, filename):
+    """
+    Record an upload's filename as uploaded.
+
+    Called once the upload has been written, so a file that fails to parse
+    can be fixed and uploaded again.
+
+    Parameters
+    ----------
+    data_dir : pathlib.Path
+        Directory where tracking and data files are stored.
+    filename : str
+        Name of the uploaded file.
+    """
+
+    _add_to_tracking_file(data_dir / "uploaded_files.txt", filename)
+
+
 def _check_existing_files(file, data_dir):
     """
-    Track uploaded filenames and warn if a file has already been uploaded.
+    Warn if a file has already been uploaded.
+
+    A file is a duplicate if its filename (which sets the Patient_ID)
+    matches an earlier upload. Checking before the CSV is parsed means a
+    duplicate is never parsed or written. New uploads are recorded
+    separately by `_record_upload`.
 
     Parameters
     ----------
@@ -136,8 +293,7 @@ def _check_existing_files(file, data_dir):
     -------
     str or None
         If the file has already been uploaded, returns rendered HTML for the
-        annotation template (early exit case).
-        Otherwise, updates the tracking file and returns None.
+        annotation template (early exit case). Otherwise returns None.
 
     Notes
     -----
@@ -145,28 +301,38 @@ def _check_existing_files(file, data_dir):
     already been uploaded in the current session.
     """
 
-    # File to store filenames that have been uploaded this session
-    uploaded_files = Path(data_dir / "uploaded_files.txt")
-
-    # Create a list from the file of uploaded filenames
-    if not uploaded_files.exists():
-        filenames = list()
-    else:
-        filenames = [
-            line.strip()
-            for line in uploaded_files.read_text(encoding="utf-8").splitlines()
-            if line.strip()
-        ]
+    # File storing filenames uploaded this session
+    known_files = _load_known(data_dir / "uploaded_files.txt")
 
     # Check the selected file against list of filenames already uploaded
-    if file.filename in filenames:
-        logger.warning(f"{file.filename} already uploaded")
+    if _is_duplicate(file.filename, known_files):
+        logger.warning("%s already uploaded", file.filename)
         flash(f"⚠ {file.filename} has already been uploaded", "warning")
-        return render_template_string(flask_utils.UPLOAD_ANNO_TEMPLATE)
+        return flask_utils.render_static_template(
+            flask_utils.UPLOAD_ANNO_TEMPLATE
+        )
 
-    # Save the updated list of uploaded files
-    filenames.append(file.filename)
-    uploaded_files.write_text("\n".join(sorted(filenames)), encoding="utf-8")
+
+def _read_csv_header(path):
+    """
+    Return the column names from the header row of a CSV file.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Path to the CSV file.
+
+    Returns
+    -------
+    list[str]
+        Column names, empty if the file is missing or empty.
+    """
+
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            return next(csv.reader(f), [])
+    except FileNotFoundError:
+        return []
 
 
 def _write_to_csv(data_dir, file, df):
@@ -184,8 +350,11 @@ def _write_to_csv(data_dir, file, df):
 
     Notes
     -----
-    - If 'input_data.csv' exists, the new data are appended without a header.
-    - If it does not exist, the file is created with a header row.
+    - If 'input_data.csv' has content, the new data are appended without a
+      header, with columns in the order of the existing header.
+    - If the new data have columns the file doesn't, the file is rewritten
+      once with the combined columns, leaving earlier rows empty in them.
+    - If it does not exist or is empty, it is written with a header row.
     """
     # CSV file to store the input data
     input_data_path = data_dir / "input_data.csv"
@@ -193,10 +362,25 @@ def _write_to_csv(data_dir, file, df):
     # This will save the dataframe as a CSV in a temporary data file.
     # It will append the CSV to existing CSVs if present. This means the user
     # can upload more than one CSV.
-
-    if input_data_path.exists():
-        df.to_csv(input_data_path, mode="a", index=False, header=False)
+    header = _read_csv_header(input_data_path)
+
+    if not header or list(df.columns) == header:
+        # Open once in append mode; the file is positioned at its end, so an
+        # empty position means a new file that needs the header row
+        with open(input_data_path, "a", encoding="utf-8", newline="") as f:
+            df.to_csv(f, index=False, header=f.tell() == 0)
+    elif set(df.columns) <= set(header):
+        # Same or fewer columns in a different order: line the values up
+        # with the existing header so they land in the right columns
+        df.reindex(columns=header).to_csv(
+            input_data_path, mode="a", index=False, header=False
+        )
     else:
-        df.to_csv(f"{data_dir}/input_data.csv", index=False)
+        # New columns, which the existing header can't hold
+        logger.info("%s adds new columns, rewriting input CSV", file.filename)
+        existing = pd.read_csv(input_data_path, dtype=str)
+        pd.concat([existing, df], ignore_index=True).to_csv(
+            input_data_path, index=False
+        )
 
     flash(f"Uploaded {file.filename}", "info")
@@ -63,7 +63,7 @@ def test_annotate_dataframe_with_mock_client(sample_esummary):
     mock_client = MagicMock(spec=annotate.ClinVarClient)
     # return a UID for first HGVS, not for second
     mock_client.search_hgvs.side_effect = [["11111"], []]
-    mock_client.fetch_esummary.return_value = sample_esummary
+    mock_client.fetch_esummaries.return_value = {"11111": sample_esummary}
     # use clinsig extractor method from client
     mock_client.extract_consensus_and_stars = (
         annotate.ClinVarClient.extract_consensus_and_stars)
@@ -80,6 +80,48 @@ def test_annotate_dataframe_with_mock_client(sample_esummary):
              or out.loc[1, "clinvar_uid"] is None}
 
 
+def test_annotate_dataframe_fetches_shared_uid_once(sample_esummary):
+    df = pd.DataFrame({"t_hgvs": ["NM_1:c.1A>T", "NM_1:c.1A>T"]})
+    mock_client = MagicMock(spec=annotate.ClinVarClient)
+    mock_client.search_hgvs.return_value = ["11111"]
+    mock_client.fetch_esummaries.return_value = {"11111": sample_esummary}
+    mock_client.extract_consensus_and_stars = (
+        annotate.ClinVarClient.extract_consensus_and_stars)
+
+    out = annotate.annotate_dataframe(df, mock_client)
+    # both rows annotated from a single esummary request for the UID
+    mock_client.fetch_esummaries.assert_called_once_with(["11111"])
+    assert out["classification"].tolist() == ["Pathogenic", "Pathogenic"]
+
+
+def test_annotate_dataframe_searches_each_hgvs_once(sample_esummary):
+    df = pd.DataFrame({"t_hgvs": ["NM_1:c.1A>T", None, "NM_1:c.1A>T"]})
+    mock_client = MagicMock(spec=annotate.ClinVarClient)
+    mock_client.search_hgvs.return_value = ["11111"]
+    mock_client.fetch_esummaries.return_value = {"11111": sample_esummary}
+    mock_client.extract_consensus_and_stars = (
+        annotate.ClinVarClient.extract_consensus_and_stars)
+
+    out = annotate.annotate_dataframe(df, mock_client)
+    # repeated HGVS searched once, missing HGVS not searched
+    mock_client.search_hgvs.assert_called_once_with("NM_1:c.1A>T")
+    assert out["star_rating"].tolist() == [4, "annotation failed", 4]
+
+
+def test_fetch_esummaries_batches_uids(sample_esummary):
+    client = annotate.ClinVarClient(session=MagicMock(), rate_limit_sleep=0)
+    responses = [
+        {"result": {"1": sample_esummary, "2": {}}},
+        {"result": {"3": sample_esummary}},
+    ]
+    with patch.object(annotate.ClinVarClient, "_get_json",
+                      side_effect=responses) as mock_get:
+        esums = client.fetch_esummaries(["1", "2", "3"], batch_size=2)
+    # one request per batch, with comma-joined UIDs
+    assert [c.args[1]["id"] for c in mock_get.call_args_list] == ["1,2", "3"]
+    assert esums == {"1": sample_esummary, "2": {}, "3": sample_esummary}
+
+
 def test_annotate_dataframe_missing_column_logs_and_raises(caplog):
     df = pd.DataFrame({"not_hgvs": ["x"]})
     with pytest.raises(KeyError):
@@ -91,13 +133,12 @@ def test_annotate_dataframe_missing_column_logs_and_raises(caplog):
 def test_process_variants_file_reads_and_writes(tmp_path, sample_esummary):
     # prepare input CSV
     in_csv = tmp_path / "input.csv"
-    df = pd.DataFrame({"t_hgvs": ["NM_1:c.1A>T"]})
-    df.to_csv(in_csv, index=False)
+    in_csv.write_text("t_hgvs\nNM_1:c.1A>T\n")
 
     # mock client
     mock_client = MagicMock(spec=annotate.ClinVarClient)
     mock_client.search_hgvs.return_value = ["22222"]
-    mock_client.fetch_esummary.return_value = sample_esummary
+    mock_client.fetch_esummaries.return_value = {"22222": sample_esummary}
     mock_client.extract_consensus_and_stars = (
         annotate.ClinVarClient.extract_consensus_and_stars)
 
@@ -109,6 +150,21 @@ def test_process_variants_file_reads_and_writes(tmp_path, sample_esummary):
     assert str(out_df.loc[0, "clinvar_uid"]) == "22222"
 
 
+def test_process_variants_file_closes_its_cache(tmp_path):
+    in_csv = tmp_path / "input.csv"
+    in_csv.write_text("t_hgvs\nNM_1:c.1A>T\n")
+
+    # the default client opens its own cache, closed even if annotation
+    # fails
+    cache = MagicMock(spec=annotate.ClinVarCache)
+    with patch.object(annotate, "ClinVarCache", return_value=cache), \
+            patch.object(annotate, "annotate_dataframe",
+                         side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            annotate.process_variants_file(in_csv)
+    cache.close.assert_called_once()
+
+
 def test_search_hgvs_returns_empty_on_exception_and_logs(caplog):
     client = annotate.ClinVarClient(session=MagicMock())
     # force _get_json to raise RequestException
@@ -118,3 +174,77 @@ def test_search_hgvs_returns_empty_on_exception_and_logs(caplog):
     assert res == []
     assert any("Failed to search ClinVar" in
                 rec.getMessage() for rec in caplog.records)
+
+
+def test_clinvar_cache_round_trip_and_expiry(tmp_path, sample_esummary):
+    cache = annotate.ClinVarCache(tmp_path / "cache.sqlite3")
+    cache.set("esummary", "11111", sample_esummary)
+    assert cache.get("esummary", "11111") == sample_esummary
+    # other request types and terms are separate entries
+    assert cache.get("esearch", "11111") is None
+    cache.close()
+
+    # entries older than max_age are treated as missing
+    expired = annotate.ClinVarCache(tmp_path / "cache.sqlite3", max_age=-1)
+    assert expired.get("esummary", "11111") is None
+    expired.close()
+
+
+def test_search_hgvs_uses_cache(tmp_path):
+    cache = annotate.ClinVarCache(tmp_path / "cache.sqlite3")
+    client = annotate.ClinVarClient(
+        session=MagicMock(), rate_limit_sleep=0, cache=cache)
+    response = {"esearchresult": {"idlist": ["11111"]}}
+    with patch.object(annotate.ClinVarClient, "_get_json",
+                      return_value=response) as mock_get:
+        first = client.search_hgvs("NM_1:c.1A>T")
+        second = client.search_hgvs("NM_1:c.1A>T")
+    # only the first search goes to NCBI
+    assert first == second == ["11111"]
+    mock_get.assert_called_once()
+    cache.close()
+
+
+def test_fetch_esummaries_only_requests_uncached_uids(
+    tmp_path, sample_esummary
+):
+    cache = annotate.ClinVarCache(tmp_path / "cache.sqlite3")
+    cache.set("esummary", "1", sample_esummary)
+    client = annotate.ClinVarClient(
+        session=MagicMock(), rate_limit_sleep=0, cache=cache)
+    with patch.object(annotate.ClinVarClient, "_get_json",
+                      return_value={"result": {"2": {}}}) as mock_get:
+        esums = client.fetch_esummaries(["1", "2"])
+    assert mock_get.call_args.args[1]["id"] == "2"
+    assert esums == {"1": sample_esummary, "2": {}}
+    # an empty result is not cached, so it is requested again next time
+    assert cache.get("esummary", "2") is None
+    cache.close()
+
+
+def test_search_hgvs_does_not_cache_empty_results(tmp_path):
+    cache = annotate.ClinVarCache(tmp_path / "cache.sqlite3")
+    client = annotate.ClinVarClient(
+        session=MagicMock(), rate_limit_sleep=0, cache=cache)
+    # a 200 response carrying an error instead of an esearchresult
+    with patch.object(annotate.ClinVarClient, "_get_json",
+                      return_value={"error": "API rate limit"}) as mock_get:
+        first = client.search_hgvs("NM_1:c.1A>T")
+        second = client.search_hgvs("NM_1:c.1A>T")
+    # both searches go to NCBI
+    assert first == second == []
+    assert mock_get.call_count == 2
+    assert cache.get("esearch", "NM_1:c.1A>T") is None
+    cache.close()
+
+
+@pytest.mark.parametrize(
+    "review_text,expected_stars",
+    [
+        ("Reviewed by expert panel ", 3),
+        ("criteria provided, multiple submitters, no conflicts found", 2),
+        ("something else", None),
+    ],
+)
+def test_review_status_to_stars_fallbacks(review_text, expected_stars):
+    assert annotate.review_status_to_stars(review_text) == expected_stars
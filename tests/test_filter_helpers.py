@@ -74,7 +74,7 @@ class TestFilterDf:
         # Patient ID column missing so will raise MissingColumnError
         with app_filter.test_request_context("/fake", method="POST", data={}):
             with pytest.raises(flask_utils.MissingColumnError) as excinfo:
-                filters._filter_df(df, filtered_path)
+                filters._filter_df(df, [], filtered_path)
 
         # Check error message
         assert "Patient_ID" in str(excinfo.value)
@@ -95,7 +95,7 @@ class TestFilterDf:
             "/fake", method="POST", data=form_data
         ):
             filtered_df, selected_ids, applied_text = filters._filter_df(
-                df, filtered_path
+                df, ["A", "B", "C"], filtered_path
             )
 
         # Check filtered_df
@@ -107,6 +107,28 @@ class TestFilterDf:
         # Checkl the text output
         assert applied_text == "Filtered by: B, C"
 
+        # Check the filtered data is written once queued writes finish
+        filters._wait_for_writes()
+        written = pd.read_csv(filtered_path)
+        assert list(written["Patient_ID"]) == ["B", "C"]
+
+    def test_filter_df_matches_numeric_patient_ids(self, tmp_path, app_filter):
+        """_filter_df matches form strings against numeric Patient_IDs."""
+        # Patient IDs read from CSV may be parsed as integers
+        df = pd.DataFrame({"Patient_ID": [1, 2, 3], "Value": [10, 20, 30]})
+
+        filtered_path = tmp_path / "filtered.csv"
+
+        with app_filter.test_request_context(
+            "/fake", method="POST", data={"patient_id": ["2"]}
+        ):
+            filtered_df, _, _ = filters._filter_df(
+                df, ["1", "2", "3"], filtered_path
+            )
+
+        # Check only the matching row is returned
+        assert list(filtered_df["Value"]) == [20]
+
     def test_filter_df_no_selected_ids_returns_full_df(
         self, tmp_path, app_filter
     ):
@@ -121,7 +143,7 @@ class TestFilterDf:
 
         with app_filter.test_request_context("/fake", method="POST", data={}):
             filtered_df, selected_ids, applied_text = filters._filter_df(
-                df, filtered_path
+                df, ["A", "B", "C"], filtered_path
             )
 
         # Check the whole dataframe is returned
@@ -133,6 +155,56 @@ class TestFilterDf:
         # Check text is correct
         assert applied_text == "No filter selected. Showing all rows."
 
+    def test_filter_df_all_selected_ids_returns_full_df(
+        self, tmp_path, app_filter
+    ):
+        """_filter_df skips filtering when every Patient_ID is selected."""
+        # Create dummy pandas dataframe
+        df = pd.DataFrame(
+            {"Patient_ID": ["A", "B", "A"], "Value": [10, 20, 30]}
+        )
+
+        filtered_path = tmp_path / "filtered.csv"
+        form_data = {"patient_id": ["A", "B"]}
+
+        with app_filter.test_request_context(
+            "/fake", method="POST", data=form_data
+        ):
+            filtered_df, selected_ids, applied_text = filters._filter_df(
+                df, ["A", "B"], filtered_path
+            )
+
+        # Check the original dataframe is returned unfiltered
+        assert filtered_df is df
+        assert selected_ids == ["A", "B"]
+        assert applied_text == "All patients selected."
+
+    def test_filter_df_skips_write_when_unchanged(self, tmp_path, app_filter):
+        """_filter_df does not rewrite the CSV for a repeated selection."""
+        # Create dummy pandas dataframe read from a known source version
+        df = pd.DataFrame(
+            {"Patient_ID": ["A", "B", "C"], "Value": [10, 20, 30]}
+        )
+        df.attrs["source_mtime_ns"] = 1
+
+        filtered_path = tmp_path / "filtered.csv"
+        form_data = {"patient_id": ["B"]}
+
+        with app_filter.test_request_context(
+            "/fake", method="POST", data=form_data
+        ):
+            filters._filter_df(df, ["A", "B", "C"], filtered_path)
+            filters._wait_for_writes()
+
+            # Overwrite the file so a second write would be detected
+            filtered_path.write_text("sentinel", encoding="utf-8")
+
+            filters._filter_df(df, ["A", "B", "C"], filtered_path)
+            filters._wait_for_writes()
+
+        # Check the file was not rewritten
+        assert filtered_path.read_text(encoding="utf-8") == "sentinel"
+
 
 class TestShowFilterPage:
     """Tests for _show_filter_page"""
@@ -153,7 +225,7 @@ class TestShowFilterPage:
         # Create HTML string using funtion
         with app_filter.test_request_context("/fake"):
             html = filters._show_filter_page(
-                df, filtered_df, selected_ids, applied_text
+                filtered_df, ["1", "2", "3"], selected_ids, applied_text
             )
 
         # Check the HTML string was returned
@@ -7,9 +7,20 @@ Group: 4
 Covers:
 - deleting files from the temporary data directory
 - redirecting back to the upload route after refresh
+- cancelling annotation jobs without waiting for a running job
+- reporting, waiting on and forgetting background annotation jobs
+- showing pages of annotated data
+- writing uploads to the configured data directory
+- showing flashed messages once on the filter page
+- showing pages of filtered data and reporting errors while building them
 """
 
+import io
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import pandas as pd
 import pytest
 from flask import Flask, url_for
 
@@ -53,3 +64,290 @@ def test_refresh_session_deletes_files_and_redirects(app, tmp_path):
 
     assert response.status_code == 302
     assert response.headers["Location"] == expected_location
+
+
+def test_refresh_session_removes_subdirectories(app, tmp_path):
+    """refresh_session also clears nested directories and leaves the data
+    directory in place."""
+    nested = tmp_path / "nested"
+    nested.mkdir()
+    (nested / "file.txt").write_text("hello")
+
+    with app.test_request_context():
+        flask_app.refresh_session(data_dir=tmp_path)
+
+    assert tmp_path.is_dir()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_refresh_session_does_not_wait_for_annotation_jobs(
+    app, tmp_path, monkeypatch
+):
+    """refresh_session cancels queued jobs and returns without waiting for
+    a running job, which removes its output files when it finishes."""
+    release = threading.Event()
+
+    def slow_pipeline(input_path, validator_path):
+        release.wait()
+        validator_path.write_text("late")
+        validator_path.with_name("anno_data.csv").write_text("late")
+
+    monkeypatch.setattr(flask_app.anno, "_run_pipeline", slow_pipeline)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    running = executor.submit(
+        flask_app._annotation_job,
+        flask_app._refresh_count,
+        tmp_path / "input_data.csv",
+        tmp_path / "validated_data.csv",
+    )
+    queued = Future()
+    flask_app._JOBS.update(running=running, queued=queued)
+
+    try:
+        with app.test_request_context():
+            flask_app.refresh_session(data_dir=tmp_path)
+
+        # Check the refresh didn't wait for the running job
+        assert not running.done()
+        assert queued.cancelled()
+        assert "running" not in flask_app._JOBS
+    finally:
+        release.set()
+        executor.shutdown()
+        flask_app._JOBS.pop("running", None)
+        flask_app._JOBS.pop("queued", None)
+
+    # Check nothing from the running job is left behind
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sweep_jobs_forgets_old_finished_jobs():
+    """_sweep_jobs forgets jobs that finished more than JOB_TTL ago."""
+    now = time.monotonic()
+    flask_app._JOBS.update(old=Future(), recent=Future())
+    flask_app._JOB_FINISHED.update(
+        old=now - flask_app.JOB_TTL - 1, recent=now
+    )
+
+    try:
+        flask_app._sweep_jobs()
+
+        assert "old" not in flask_app._JOBS
+        assert "old" not in flask_app._JOB_FINISHED
+        assert "recent" in flask_app._JOBS
+    finally:
+        for job_id in ["old", "recent"]:
+            flask_app._JOBS.pop(job_id, None)
+            flask_app._JOB_FINISHED.pop(job_id, None)
+
+
+def test_annotate_records_when_job_finishes(client, tmp_path, monkeypatch):
+    """Jobs started by the annotate route record when they finished."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(flask_app.anno, "_run_pipeline", lambda *args: None)
+
+    response = client.post("/annotate")
+    job_id = response.headers["Location"].rsplit("/", 1)[-1]
+
+    try:
+        flask_app._JOBS[job_id].result()
+        assert job_id in flask_app._JOB_FINISHED
+    finally:
+        flask_app._JOBS.pop(job_id, None)
+        flask_app._JOB_FINISHED.pop(job_id, None)
+
+
+def test_refresh_session_handles_missing_data_dir(app, tmp_path):
+    """refresh_session still redirects when there is no data directory."""
+    with app.test_request_context():
+        response = flask_app.refresh_session(data_dir=tmp_path / "missing")
+
+    assert response.status_code == 302
+
+
+@pytest.fixture
+def client():
+    """Test client for the parkVar app."""
+    flask_app.app.config["TESTING"] = True
+    with flask_app.app.test_client() as client:
+        yield client
+
+
+def test_annotation_status_reports_job_state(client):
+    """annotation_status returns the state of known and unknown jobs."""
+    # Create finished and unfinished jobs
+    running = Future()
+    done = Future()
+    done.set_result(None)
+    failed = Future()
+    failed.set_exception(RuntimeError("boom"))
+
+    flask_app._JOBS.update(running=running, done=done, failed=failed)
+
+    try:
+        for job_id in ["running", "done", "failed"]:
+            response = client.get(f"/status/{job_id}")
+            assert response.get_json() == {"status": job_id}
+
+        response = client.get("/status/missing")
+        assert response.get_json() == {"status": "unknown"}
+    finally:
+        for job_id in ["running", "done", "failed"]:
+            flask_app._JOBS.pop(job_id, None)
+
+
+def test_annotation_result_waits_while_job_running(client):
+    """annotation_result shows a polling page until the job finishes."""
+    flask_app._JOBS["running"] = Future()
+
+    try:
+        response = client.get("/annotate/running")
+    finally:
+        flask_app._JOBS.pop("running", None)
+
+    html = response.get_data(as_text=True)
+
+    # Check the waiting page polls the status endpoint
+    assert response.status_code == 200
+    assert "Annotating variants" in html
+    assert "/status/running" in html
+
+    # Check failed status requests are retried
+    assert ".catch(" in html
+
+
+def test_annotation_result_redirects_for_unknown_job(client):
+    """annotation_result redirects to the upload page for an unknown job."""
+    response = client.get("/annotate/missing")
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+
+
+def test_annotation_result_redirects_when_job_done(client):
+    """annotation_result forgets a finished job and redirects to its
+    data."""
+    done = Future()
+    done.set_result(None)
+    flask_app._JOBS["done"] = done
+
+    response = client.get("/annotate/done")
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/annotated"
+    assert "done" not in flask_app._JOBS
+
+
+def test_annotated_data_renders_requested_page(client, monkeypatch):
+    """annotated_data builds the table for the page in the query string."""
+    pages = []
+
+    def fake_build_table(anno_path, page=None):
+        pages.append(page)
+        df = pd.DataFrame({"Patient_ID": ["P1"]})
+        return df, "<table>page table</table>"
+
+    monkeypatch.setattr(flask_app.anno, "_build_table", fake_build_table)
+
+    response = client.get("/annotated?page=3")
+    html = response.get_data(as_text=True)
+
+    assert pages == [3]
+    assert "page table" in html
+    assert "P1" in html
+
+
+def test_upload_writes_to_configured_data_dir(client, tmp_path, monkeypatch):
+    """The upload route stores its files in app.config["DATA_DIR"]."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+
+    response = client.post(
+        "/",
+        data={"file": (io.BytesIO(b"#CHROM,POS\n1,100\n"), "P1.csv")},
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 200
+    assert (tmp_path / "input_data.csv").read_text().splitlines() == [
+        "Patient_ID,#CHROM,POS",
+        "P1,1,100",
+    ]
+
+
+def test_filter_page_shows_flashed_messages_once(
+    client, tmp_path, monkeypatch
+):
+    """Messages flashed before the filter page are shown on it and not
+    again on the next page."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+    (tmp_path / "anno_data.csv").write_text("Patient_ID,col1\nP1,1\n")
+
+    with client.session_transaction() as session:
+        session["_flashes"] = [("info", "Flashed before filtering")]
+
+    response = client.post("/filter", data={"patient_id": ["P1"]})
+    assert "Flashed before filtering" in response.get_data(as_text=True)
+    flask_app.filters._wait_for_writes()
+
+    response = client.get("/")
+    assert "Flashed before filtering" not in response.get_data(as_text=True)
+
+
+def test_filter_page_shows_requested_page(client, tmp_path, monkeypatch):
+    """The filter page shows one page of the filtered rows."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+    rows = "".join(f"P1,{i}\n" for i in range(250))
+    (tmp_path / "anno_data.csv").write_text("Patient_ID,col1\n" + rows)
+
+    response = client.post("/filter?page=1", data={"patient_id": ["P1"]})
+    flask_app.filters._wait_for_writes()
+
+    html = response.get_data(as_text=True)
+    assert "<p>Rows: 250</p>" in html
+    assert "Page 2 of 2" in html
+    assert html.count("<tr>") == 50
+
+
+def test_filter_page_links_keep_selection(client, tmp_path, monkeypatch):
+    """The filter page's page links keep the selected Patient_IDs."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+    rows = "".join(f"P1,{i}\n" for i in range(250)) + "P2,0\n"
+    (tmp_path / "anno_data.csv").write_text("Patient_ID,col1\n" + rows)
+
+    response = client.post("/filter", data={"patient_id": ["P1"]})
+    assert "href='?patient_id=P1&amp;page=1'" in response.get_data(
+        as_text=True
+    )
+
+    # Follow the link to the next page
+    response = client.get("/filter?patient_id=P1&page=1")
+    flask_app.filters._wait_for_writes()
+
+    html = response.get_data(as_text=True)
+    assert "Filtered by: P1" in html
+    assert "<p>Rows: 250</p>" in html
+    assert "Page 2 of 2" in html
+    assert "href='?patient_id=P1&amp;page=0'" in html
+
+
+def test_filter_page_errors_use_error_handler(client, tmp_path, monkeypatch):
+    """Errors raised while building the filtered table are reported by the
+    AppError handler."""
+    monkeypatch.setitem(flask_app.app.config, "DATA_DIR", tmp_path)
+    (tmp_path / "anno_data.csv").write_text("Patient_ID,col1\nP1,1\n")
+
+    def fail_table(df, page, params=None):
+        raise flask_app.flask_utils.CSVReadError(
+            context="anno_data.csv", original_exception=ValueError("bad")
+        )
+
+    monkeypatch.setattr(
+        flask_app.filters.flask_utils, "create_table_page", fail_table
+    )
+
+    response = client.post("/filter", data={"patient_id": ["P1"]})
+    flask_app.filters._wait_for_writes()
+
+    assert response.status_code == 400
+    assert "anno_data.csv" in response.get_data(as_text=True)
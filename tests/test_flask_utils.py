@@ -6,12 +6,17 @@ Group: 4
 
 Covers:
 - HTML table generation via create_table
+- cached loading of annotated CSVs via read_anno_csv
 - checkbox rendering and Patient_ID handling in show_checkboxes
 """
 
+import os
+import re
+
+import jinja2
 import pandas as pd
 import pytest
-from flask import Flask
+from flask import Flask, flash
 
 from parkVar.utils import flask_utils
 
@@ -26,6 +31,169 @@ def app():
         yield app
 
 
+class TestOptimiseDtypes:
+    """Tests for optimise_dtypes"""
+
+    def test_optimise_dtypes_shrinks_columns(self):
+        """Integers are downcast and repeated text becomes categorical."""
+        df = pd.DataFrame(
+            {
+                "POS": [100, 200, 300, 400],
+                "CHROM": ["1", "1", "17", "17"],
+                "t_hgvs": ["a", "b", "c", "d"],
+                "score": [0.1, 0.2, 0.3, 0.4],
+            }
+        )
+
+        flask_utils.optimise_dtypes(df)
+
+        # Check integer and low-cardinality text columns were shrunk
+        assert df["POS"].dtype == "int16"
+        assert isinstance(df["CHROM"].dtype, pd.CategoricalDtype)
+
+        # Check unique text and floats are left alone
+        assert df["t_hgvs"].dtype == object
+        assert df["score"].dtype == "float64"
+
+        # Check values are unchanged
+        assert df["POS"].tolist() == [100, 200, 300, 400]
+        assert df["CHROM"].tolist() == ["1", "1", "17", "17"]
+
+
+class TestRenderStaticTemplate:
+    """Tests for render_static_template"""
+
+    def test_render_static_template_compiles_once(self, app):
+        """render_static_template reuses the compiled template."""
+        source = "<p>{{ word }}</p>"
+        flask_utils._compile_template.cache_clear()
+
+        try:
+            # Render the same template twice with different values
+            first = flask_utils.render_static_template(source, word="one")
+            second = flask_utils.render_static_template(source, word="two")
+
+            # Check both renders are correct and the template was reused
+            assert first == "<p>one</p>"
+            assert second == "<p>two</p>"
+            info = flask_utils._compile_template.cache_info()
+            assert (info.misses, info.hits) == (1, 1)
+
+            # Check other sources aren't added to the module's templates
+            assert source not in flask_utils._COMPILED_TEMPLATES
+        finally:
+            flask_utils._compile_template.cache_clear()
+
+    def test_module_templates_precompiled(self):
+        """The module's templates are compiled when it is imported."""
+        for source in [
+            flask_utils.UPLOAD_PAGE,
+            flask_utils.UPLOAD_ANNO_TEMPLATE,
+            flask_utils.CHECKBOX_TEMPLATE,
+            flask_utils.ERROR_TEMPLATE,
+        ]:
+            # The UPLOAD_PAGE prefix is compiled on its own
+            if source != flask_utils.UPLOAD_PAGE:
+                source = source.removeprefix(flask_utils.UPLOAD_PAGE)
+            assert source in flask_utils._COMPILED_TEMPLATES
+
+    def test_templates_loaded_from_bytecode_cache(self, monkeypatch):
+        """A new environment loads the compiled templates from the cache
+        directory instead of compiling them again."""
+        cache = flask_utils._ENV.bytecode_cache
+        assert cache.directory == str(flask_utils.TEMPLATE_CACHE_DIR)
+
+        # Compiling the source again would fail
+        def fail_compile(*args, **kwargs):
+            raise AssertionError("template compiled again")
+
+        monkeypatch.setattr(jinja2.Environment, "compile", fail_compile)
+        env = jinja2.Environment(
+            loader=flask_utils._ENV.loader,
+            autoescape=True,
+            bytecode_cache=cache,
+        )
+
+        html = env.get_template("error.html").render(msg="boom")
+        assert "boom" in html
+
+    def test_template_cache_skipped_when_directory_unusable(self, tmp_path):
+        """No bytecode cache is used if its directory can't be created."""
+        blocker = tmp_path / "file"
+        blocker.write_text("not a directory")
+
+        assert flask_utils._template_bytecode_cache(blocker / "jinja") is None
+
+    def test_render_static_template_escapes_values(self, app):
+        """Values are autoescaped unless marked safe."""
+        html = flask_utils.render_static_template(
+            flask_utils.ERROR_TEMPLATE, msg="<b>bad</b>"
+        )
+
+        assert "&lt;b&gt;bad&lt;/b&gt;" in html
+
+    def test_render_static_template_matches_whole_template(self, app):
+        """Rendering UPLOAD_PAGE separately gives the same page as rendering
+        the whole template."""
+        env = jinja2.Environment(autoescape=True)
+        expected = env.from_string(flask_utils.UPLOAD_TEMPLATE).render(
+            flashes=""
+        )
+
+        html = flask_utils.render_static_template(flask_utils.UPLOAD_TEMPLATE)
+
+        assert html == expected
+
+    def test_render_static_template_renders_flashes(self):
+        """Flashed messages are escaped and rendered into the flashes slot."""
+        app = Flask(__name__)
+        app.secret_key = "testing"  # required for flash()
+
+        with app.test_request_context("/"):
+            flash("<b>hi</b>", "info")
+            html = flask_utils.render_static_template(
+                flask_utils.UPLOAD_TEMPLATE
+            )
+
+        assert '<ul class="flashes"><li class="info">' in html
+        assert "&lt;b&gt;hi&lt;/b&gt;" in html
+
+    def test_upload_anno_template_renders_table(self, app):
+        """UPLOAD_ANNO_TEMPLATE places the table after the upload form."""
+        html = flask_utils.render_static_template(
+            flask_utils.UPLOAD_ANNO_TEMPLATE, table="<table></table>"
+        )
+
+        assert html.index("Uploaded data") < html.index("<table></table>")
+
+
+class TestAppErrors:
+    """Tests for the AppError subclasses"""
+
+    @pytest.mark.parametrize(
+        "error_class,expected",
+        [
+            (flask_utils.CSVReadError, "Failure reading: x.csv: boom"),
+            (flask_utils.MissingFileError, "Could not find: x.csv: boom"),
+            (flask_utils.ProcessError, "x.csv step has failed: boom"),
+            (flask_utils.MissingColumnError, "x.csv column is missing: boom"),
+        ],
+    )
+    def test_error_message_and_log(self, caplog, error_class, expected):
+        """Each error builds its message from the context and logs it."""
+        error = error_class(
+            context="x.csv", original_exception=ValueError("boom")
+        )
+
+        # Check the message and the attributes are kept
+        assert str(error) == expected
+        assert error.context == "x.csv"
+        assert isinstance(error.original_exception, ValueError)
+
+        # Check the same message was logged
+        assert expected in [rec.getMessage() for rec in caplog.records]
+
+
 class TestCreateTable:
     """Tests for create_table"""
 
@@ -72,6 +240,199 @@ class TestCreateTable:
         assert "col2" in html
 
 
+class TestCreateTablePage:
+    """Tests for create_table_page"""
+
+    def test_renders_only_requested_rows(self):
+        """Only the page's rows are rendered, with the total row count."""
+        df = pd.DataFrame({"col1": [f"v{i}" for i in range(5)]})
+
+        html = flask_utils.create_table_page(df, page=1, page_size=2)
+
+        assert "<p>Rows: 5</p>" in html
+        assert "Page 2 of 3" in html
+        assert "<td>v2</td>" in html
+        assert "<td>v3</td>" in html
+        assert "v1" not in html
+        assert "v4" not in html
+
+        # Links to both neighbouring pages
+        assert "href='?page=0'" in html
+        assert "href='?page=2'" in html
+
+    def test_links_keep_query_params(self):
+        """Page links keep the given query parameters."""
+        df = pd.DataFrame({"col1": [f"v{i}" for i in range(5)]})
+
+        html = flask_utils.create_table_page(
+            df, page=1, page_size=2, params={"patient_id": ["P1", "P&2"]}
+        )
+
+        # Repeated values are kept and the query is escaped
+        query = "patient_id=P1&amp;patient_id=P%262&amp;page="
+        assert f"href='?{query}0'" in html
+        assert f"href='?{query}2'" in html
+
+    @pytest.mark.parametrize("page,expected", [(-1, "v0"), (9, "v4")])
+    def test_out_of_range_page_shows_nearest(self, page, expected):
+        """Pages before the first or after the last are clamped."""
+        df = pd.DataFrame({"col1": [f"v{i}" for i in range(5)]})
+
+        html = flask_utils.create_table_page(df, page=page, page_size=2)
+
+        assert f"<td>{expected}</td>" in html
+        assert "Previous" not in html or "Next" not in html
+
+
+class TestIterTableHtml:
+    """Tests for iter_table_html"""
+
+    def test_iter_table_html_matches_single_chunk(self, app):
+        """Rendering in several chunks gives one table with all rows."""
+        # Create a dummy dataframe
+        df = pd.DataFrame({"col1": [1, 2, 3], "col2": ["a", "b", "c"]})
+
+        # Render one row per chunk
+        html = "".join(flask_utils.iter_table_html(df, chunk_rows=1))
+
+        # Check there is a single table and header row
+        assert html.count("<table") == 1
+        assert html.count("<thead>") == 1
+        assert html.count("<tbody>") == 1
+
+        # Check the output matches rendering in one chunk, ignoring the
+        # whitespace between rows
+        single = flask_utils.create_table(df)
+        assert "".join(html.split()) == "".join(single.split())
+        assert "<p>Rows: 3</p>" in html
+        assert html.count("<tr>") == 3
+
+    def test_iter_table_html_escapes_values_and_shows_missing(self, app):
+        """Cell values are HTML escaped and missing values shown as NaN."""
+        df = pd.DataFrame({"<col>": ["<b>", None], "num": [1.5, None]})
+
+        html = "".join(flask_utils.iter_table_html(df))
+
+        # Check header and cell values are escaped
+        assert "<th>&lt;col&gt;</th>" in html
+        assert "<td>&lt;b&gt;</td>" in html
+
+        # Check missing values match to_html's output
+        assert "<td>1.5</td>" in html
+        assert "<td>None</td>" in html
+        assert "<td>NaN</td>" in html
+
+    def test_iter_table_html_cells_match_to_html(self, app):
+        """Cell text matches to_html for mixed precision floats and NAs."""
+        df = pd.DataFrame(
+            {
+                "float": [1.5, 0.1234567, None],
+                "small": [1e-09, 2.5, 3.0],
+                "text": ["x", None, "<y>"],
+                "count": pd.array([1, None, 3], dtype="Int64"),
+                "int": [1, 2, 3],
+            }
+        )
+
+        html = "".join(flask_utils.iter_table_html(df, chunk_rows=2))
+
+        # Check each cell shows the same text as pandas' own rendering
+        cells = re.findall(r"<td>(.*?)</td>", html)
+        expected = re.findall(r"<td>(.*?)</td>", df.to_html(index=False))
+        assert cells == expected
+
+
+class TestGetPatientIds:
+    """Tests for get_patient_ids"""
+
+    @pytest.mark.parametrize(
+        "values,expected",
+        [
+            (["P2", "P1", None, "P2"], ["P1", "P2"]),
+            ([3, 1, 2, 1], ["1", "2", "3"]),
+            (pd.Categorical(["P2", "P1", "P2"]), ["P1", "P2"]),
+        ],
+    )
+    def test_get_patient_ids_sorted_unique_strings(self, values, expected):
+        """get_patient_ids returns sorted unique IDs as strings."""
+        df = pd.DataFrame({"Patient_ID": values})
+
+        assert flask_utils.get_patient_ids(df) == expected
+
+
+class TestReadAnnoCsv:
+    """Tests for read_anno_csv"""
+
+    def test_unchanged_file_is_not_parsed_again(self, tmp_path, monkeypatch):
+        """A second read of an unchanged file is served from the cache."""
+        anno_path = tmp_path / "anno_data.csv"
+        anno_path.write_text("Patient_ID,col1\nP1,1\nP2,2\n", "utf-8")
+
+        first = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+
+        # Any further parse would now fail
+        def fail(*args, **kwargs):
+            raise AssertionError("CSV parsed again")
+
+        monkeypatch.setattr(flask_utils.pd, "read_csv", fail)
+        second = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+
+        assert second["Patient_ID"].tolist() == ["P1", "P2"]
+        assert second.attrs == first.attrs
+
+    def test_changed_file_is_parsed_again(self, tmp_path):
+        """Rewriting the file returns the new data."""
+        anno_path = tmp_path / "anno_data.csv"
+        anno_path.write_text("col1\n1\n", "utf-8")
+        flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+
+        anno_path.write_text("col1\n1\n2\n", "utf-8")
+        df = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+
+        assert df["col1"].tolist() == [1, 2]
+
+    def test_text_columns_keep_their_written_form(self, tmp_path):
+        """Known ID columns are read as text rather than numbers."""
+        anno_path = tmp_path / "anno_data.csv"
+        anno_path.write_text(
+            "Patient_ID,clinvar_uid,disease_mim\n007,11,123456\n007,12,\n",
+            "utf-8",
+        )
+
+        df = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+
+        assert df["Patient_ID"].tolist() == ["007", "007"]
+        assert df["clinvar_uid"].tolist() == ["11", "12"]
+        assert df.loc[0, "disease_mim"] == "123456"
+
+    def test_replacing_a_column_leaves_cache_unchanged(self, tmp_path):
+        """Callers get a copy whose columns can be replaced safely."""
+        anno_path = tmp_path / "anno_data.csv"
+        anno_path.write_text("col1,col2\n1,2\n", "utf-8")
+
+        df = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+        df["col1"] = [99]
+
+        df = flask_utils.read_anno_csv(anno_path, os.stat(anno_path))
+        assert df["col1"].tolist() == [1]
+
+
+class TestCheckboxStates:
+    """Tests for checkbox_states"""
+
+    def test_checkbox_states_keeps_order_and_marks_selected(self):
+        """checkbox_states maps each ID, in order, to its checked state."""
+        states = flask_utils.checkbox_states(
+            ["P1", "P2", "P3"], frozenset({"P3", "P1"})
+        )
+
+        assert list(states.items()) == [
+            ("P1", True),
+            ("P2", False),
+            ("P3", True),
+        ]
+
+
 class TestShowCheckboxes:
     """Tests for show_checkboxes"""
 
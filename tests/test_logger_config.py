@@ -9,8 +9,13 @@ Covers validation of:
 - stream and file logging levels
 - maxBytes argument
 - backupCount argument
+
+and the timestamps produced by CachedFormatter.
 """
 
+import logging
+from pathlib import Path
+
 import pytest
 
 from parkVar.utils import logger_config as log_setup
@@ -19,44 +24,88 @@ from parkVar.utils import logger_config as log_setup
 class TestSetupLoggerValidation:
     """Tests for setup_logger"""
 
-    def test_name_must_be_string(self):
+    # Name must strictly be a string
+    @pytest.mark.parametrize("name", [123, None])
+    def test_name_must_be_string(self, name):
         """setup_logger raises TypeError if name is not a string."""
+        with pytest.raises(TypeError, match="name must be a string"):
+            log_setup.setup_logger(name=name)
 
-        # Name must strictly be a string
-        with pytest.raises(TypeError):
-            log_setup.setup_logger(name=123)
+    @pytest.mark.parametrize(
+        "kwarg,value",
+        # Levels must be one of the valid logging levels
+        [("stream_level", v) for v in ["abc", None, 15, -1, 999]]
+        + [("file_level", v) for v in ["abc", None, 17, -20, 123]]
+        # maxBytes must be a positive integer
+        + [("maxBytes", v) for v in ["abc", None, 0, -1, -500]]
+        # backupCount must be a non negative integer
+        + [("backupCount", v) for v in ["abc", None, -1, -3]],
+    )
+    def test_invalid_parameters(self, kwarg, value):
+        """setup_logger raises ValueError for invalid levels, maxBytes or
+        backupCount."""
+        # Both level checks share one message
+        param = "level" if kwarg.endswith("_level") else kwarg
+        with pytest.raises(ValueError, match=f"^{param} must be"):
+            log_setup.setup_logger(name="x", **{kwarg: value})
 
-        with pytest.raises(TypeError):
-            log_setup.setup_logger(name=None)
+    def test_existing_logger_is_not_configured_again(self):
+        """setup_logger returns an already configured logger unchanged."""
+        handlers = list(log_setup.logger.handlers)
 
-    @pytest.mark.parametrize("stream_level", ["abc", None, 15, -1, 999])
-    def test_invalid_stream_levels(self, stream_level):
-        """setup_logger raises ValueError for invalid stream_level values."""
+        logger = log_setup.setup_logger("parkVar_logger")
 
-        # Stream level must be one of the valid logging levels
-        with pytest.raises(ValueError):
-            log_setup.setup_logger(name="x", stream_level=stream_level)
+        # Check no duplicate handlers were added
+        assert logger is log_setup.logger
+        assert logger.handlers == handlers
 
-    @pytest.mark.parametrize("file_level", ["abc", None, 17, -20, 123])
-    def test_invalid_file_levels(self, file_level):
-        """setup_logger raises ValueError for invalid file_level values."""
-        # File level must be one of the valid logging levels
-        with pytest.raises(ValueError):
-            log_setup.setup_logger(name="x", file_level=file_level)
+    @pytest.mark.parametrize(
+        "file_level,stream_level",
+        [(20, 30), (30, 10), (20, 20), (10, 0), (0, 20)],
+    )
+    def test_logger_level_is_lowest_handler_level(
+        self, file_level, stream_level
+    ):
+        """The logger lets through records wanted by either handler."""
+        name = f"test_levels_{file_level}_{stream_level}"
+        logger = log_setup.setup_logger(
+            name, file_level=file_level, stream_level=stream_level
+        )
 
-    @pytest.mark.parametrize("maxbytes", ["abc", None, 0, -1, -500])
-    def test_invalid_maxbytes(self, maxbytes):
-        """setup_logger raises ValueError when maxBytes is not a positive
-        integer."""
-        # maxBytes must be a positive integer
-        with pytest.raises(ValueError):
-            log_setup.setup_logger(name="x", maxBytes=maxbytes)
+        # NOTSET (0) handlers take everything the logger lets through
+        lowest = min(lvl for lvl in (file_level, stream_level) if lvl)
 
-    @pytest.mark.parametrize("backupcount", ["abc", None, -1, -3])
-    def test_invalid_backupcount(self, backupcount):
-        """setup_logger raises ValueError when backupCount is negative or
-        invalid."""
+        try:
+            assert logger.level == lowest
+            assert logger.getEffectiveLevel() == lowest
 
-        # backupCount must be a non negative integer
-        with pytest.raises(ValueError):
-            log_setup.setup_logger(name="x", backupCount=backupcount)
+            # Check each handler still applies its own level
+            stream_handler, file_handler = logger.handlers
+            assert max(stream_handler.level, logger.level) == max(
+                stream_level, lowest
+            )
+            assert max(file_handler.level, logger.level) == max(
+                file_level, lowest
+            )
+        finally:
+            # Remove the handlers and the log file created for the test
+            for handler in list(logger.handlers):
+                handler.close()
+                logger.removeHandler(handler)
+            Path(file_handler.baseFilename).unlink(missing_ok=True)
+
+
+class TestCachedFormatter:
+    """Tests for CachedFormatter"""
+
+    def test_format_time_matches_default_formatter(self):
+        """CachedFormatter gives the same asctime as logging.Formatter."""
+        cached = log_setup.CachedFormatter()
+        default = logging.Formatter()
+
+        # Records in the same second and in the next second
+        for created in [1700000000.123, 1700000000.987, 1700000001.004]:
+            record = logging.makeLogRecord({"created": created})
+            record.msecs = (created - int(created)) * 1000
+
+            assert cached.formatTime(record) == default.formatTime(record)
@@ -8,19 +8,24 @@ Covers:
 - writing/append behaviour for input_data.csv
 """
 
+import contextlib
 import io
+import os
 
 import pandas as pd
 import pytest
 from flask import Flask, get_flashed_messages, request
+from werkzeug.datastructures import FileStorage
 
 from parkVar.utils import flask_utils
 from parkVar.utils import upload_helpers as uploads
 
 
 # Create flask app context - from ChatGPT
-@pytest.fixture
-def app_upload():
+@pytest.fixture(scope="session")
+def app():
+    """One Flask app shared by every test. Each test enters its own request
+    context, so flashed messages don't leak between tests."""
     app = Flask(__name__)
     app.secret_key = "testing"  # required for flash()
     return app
@@ -29,14 +34,14 @@ def app_upload():
 class TestUploadFile:
     """Tests for _upload_file."""
 
-    def test_no_file_uploaded_returns_400(self, app_upload):
+    def test_no_file_uploaded_returns_400(self, app):
         """No file in POST data returns (HTML, 400) and warning flash."""
 
         # From ChatGPT
 
         # An error HTML and error status code is returned when there is no
         # file. Assign these as "response" and "status".
-        with app_upload.test_request_context("/", method="POST", data={}):
+        with app.test_request_context("/", method="POST", data={}):
             response, status = uploads._upload_file(request)
 
             # Check the error response code
@@ -47,7 +52,7 @@ class TestUploadFile:
             flashed = get_flashed_messages(with_categories=True)
             assert ("warning", "No file uploaded") in flashed
 
-    def test_upload_success_returns_file(self, app_upload):
+    def test_upload_success_returns_file(self, app):
         """Valid upload returns a FileStorage object with correct content."""
 
         # From ChatGPT
@@ -56,7 +61,7 @@ class TestUploadFile:
         data = {"file": (io.BytesIO(b"hello world"), "test.csv")}
 
         # File is returned when a file is provided. Store as "file".
-        with app_upload.test_request_context("/", method="POST", data=data):
+        with app.test_request_context("/", method="POST", data=data):
             file = uploads._upload_file(request)
 
             # "file" is a FileStorage object so has the "filename" attribute
@@ -69,77 +74,115 @@ class TestUploadFile:
             assert file.read() == b"hello world"
 
 
-class TestCreatePandasDataframe:
-    """Tests for _create_pandas_dataframe."""
-
-    def test_creates_dataframe_and_inserts_patient_id(self):
-        """Patient_ID column is added from filename as first column."""
-
-        # Create a dummy CsV
-        csv_content = "col1,col2\n1,2\n3,4\n"
+@pytest.fixture
+def make_fake_file():
+    """Factory for dummy uploaded files: a named BytesIO of the content.
 
-        # Create a dummy file from CSV
-        fake_file = io.BytesIO(csv_content.encode("utf-8"))
+    Content may be str (encoded as UTF-8) or bytes. Each call returns a new
+    buffer, so tests can't see each other's reads.
+    """
 
-        # Name the dummy file
-        fake_file.filename = "P123.csv"
+    def _make_fake_file(content, filename):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        fake_file = io.BytesIO(content)
+        fake_file.filename = filename
+        return fake_file
 
-        # Create pandas dataframe using the function
-        df = uploads._create_pandas_dataframe(fake_file)
+    return _make_fake_file
 
-        # Patient_ID added as first column
-        assert list(df.columns) == ["Patient_ID", "col1", "col2"]
-        assert df["Patient_ID"].tolist() == ["P123", "P123"]
-        assert df["col1"].tolist() == [1, 3]
-        assert df["col2"].tolist() == [2, 4]
 
-    def test_overwrites_existing_patient_id_with_filename(self):
-        """Existing Patient_ID column is replaced by one derived from
-        filename."""
+class TestCreatePandasDataframe:
+    """Tests for _create_pandas_dataframe."""
 
-        # Create dummy CSV
-        csv_content = "Patient_ID,col1\nOLD1,10\nOLD2,20\n"
+    @pytest.mark.parametrize(
+        "csv_content,filename,expected_cols,expected_values",
+        [
+            # Patient_ID added from filename as first column
+            (
+                "col1,col2\n1,2\n3,4\n",
+                "P123.csv",
+                ["Patient_ID", "col1", "col2"],
+                {"col1": [1, 3], "col2": [2, 4]},
+            ),
+            # Existing Patient_ID column replaced by one from filename
+            (
+                "Patient_ID,col1\nOLD1,10\nOLD2,20\n",
+                "NEWPAT.csv",
+                ["Patient_ID", "col1"],
+                {"col1": [10, 20]},
+            ),
+            # ID column dropped when present
+            (
+                "ID,col1,col2\n10,1,2\n11,3,4\n",
+                "P999.csv",
+                ["Patient_ID", "col1", "col2"],
+                {"col1": [1, 3], "col2": [2, 4]},
+            ),
+        ],
+        ids=["inserts_patient_id", "overwrites_patient_id", "drops_id"],
+    )
+    def test_normalises_columns(
+        self,
+        make_fake_file,
+        csv_content,
+        filename,
+        expected_cols,
+        expected_values,
+    ):
+        """Patient_ID is derived from the filename and replaces any existing
+        Patient_ID or ID column."""
+        fake_file = make_fake_file(csv_content, filename)
 
-        # Create dumym file from CSV
-        fake_file = io.BytesIO(csv_content.encode("utf-8"))
+        # Create pandas dataframe using the function
+        df = uploads._create_pandas_dataframe(fake_file)
 
-        # Name the dummy file
-        fake_file.filename = "NEWPAT.csv"
+        # Patient_ID is the first column, as a categorical of the file stem
+        assert list(df.columns) == expected_cols
+        expected_pid = filename.removesuffix(".csv")
+        assert df["Patient_ID"].tolist() == [expected_pid] * len(df)
+        assert isinstance(df["Patient_ID"].dtype, pd.CategoricalDtype)
+        for col, values in expected_values.items():
+            assert df[col].tolist() == values
+
+    def test_reads_werkzeug_file_storage(self):
+        """An uploaded FileStorage is parsed from its stream."""
+        # Wrap a dummy CSV as Flask would for a form upload
+        fake_file = FileStorage(
+            stream=io.BytesIO("col1\nα\n".encode("utf-8")),
+            filename="P1.csv",
+        )
 
-        # Create pandas dataframe using the function
         df = uploads._create_pandas_dataframe(fake_file)
 
-        # Old Patient_ID column removed, new one inserted from filename
+        # Check UTF-8 text is decoded and Patient_ID is added
         assert list(df.columns) == ["Patient_ID", "col1"]
-        assert df["Patient_ID"].tolist() == ["NEWPAT", "NEWPAT"]
-        assert df["col1"].tolist() == [10, 20]
+        assert df["col1"].tolist() == ["α"]
 
-    def test_drops_id_column_if_present(self):
-        """ID column is dropped when present."""
-        # Create dummy CSV
-        csv_content = "ID,col1,col2\n10,1,2\n11,3,4\n"
+    def test_reads_from_start_of_stream(self, make_fake_file):
+        """A stream that has already been read is parsed from the start."""
+        fake_file = make_fake_file("col1\n1\n2\n", "P1.csv")
+        fake_file.read()
 
-        # Create dummy file from CSV
-        fake_file = io.BytesIO(csv_content.encode("utf-8"))
+        df = uploads._create_pandas_dataframe(fake_file)
 
-        # Name dummy file
-        fake_file.filename = "P999.csv"
+        assert df["col1"].tolist() == [1, 2]
+
+    def test_reads_chromosome_as_text(self, make_fake_file):
+        """#CHROM is read as text so numbered and X/Y chromosomes match."""
+        fake_file = make_fake_file(
+            "#CHROM,POS,REF,ALT\n17,100,G,T\nX,200,C,G\n", "P1.csv"
+        )
 
-        # Create pandas dataframe using funtion
         df = uploads._create_pandas_dataframe(fake_file)
 
-        # ID is not in the column names
-        assert "ID" not in df.columns
-        assert list(df.columns) == ["Patient_ID", "col1", "col2"]
-        assert df["Patient_ID"].tolist() == ["P999", "P999"]
+        assert df["#CHROM"].tolist() == ["17", "X"]
+        assert df["POS"].tolist() == [100, 200]
 
-    def test_raises_csvreaderror(self):
+    def test_raises_csvreaderror(self, make_fake_file):
         """Invalid CSV content raises CSVReadError with filename in message."""
         # Create a bad file
-        fake_file = io.BytesIO(b"\xff\xfe\xfa")  # ChatGPT
-
-        # Name the bad file
-        fake_file.filename = "bad.csv"
+        fake_file = make_fake_file(b"\xff\xfe\xfa", "bad.csv")  # ChatGPT
 
         # Check the bad file raises a CSVReadError
         with pytest.raises(flask_utils.CSVReadError) as excinfo:
@@ -150,11 +193,8 @@ class TestCreatePandasDataframe:
 
 
 @pytest.fixture
-def app_exist(tmp_path):
+def app_exist(app, tmp_path):
     """Provide Flask app & a fresh temp directory for uploaded_files.txt."""
-    app = Flask(__name__)
-    app.secret_key = "testing"
-
     # make a temp data_dir for each test
     data_dir = tmp_path / "data"
     data_dir.mkdir()
@@ -164,119 +204,167 @@ def app_exist(tmp_path):
 
 class TestCheckExistingFiles:
     """Tests for _check_existing_files."""
-    def test_first_upload_creates_file_and_returns_none(self, app_exist):
-        """First upload creates uploaded_files.txt and returns None with no
-        flashes."""
 
+    @pytest.mark.parametrize(
+        "recorded,upload,expected_flash",
+        [
+            # First upload: nothing recorded, so no duplicate
+            ([], (b"hi", "example.csv"), None),
+            # Same filename as an earlier upload
+            (
+                ["example.csv"],
+                (b"hi again", "example.csv"),
+                "⚠ example.csv has already been uploaded",
+            ),
+            # Same contents under a different name is a different patient
+            (["P1.csv"], (b"hi", "P2.csv"), None),
+        ],
+        ids=["first_upload", "duplicate_name", "new_name"],
+    )
+    def test_reports_duplicates(
+        self, app_exist, make_fake_file, recorded, upload, expected_flash
+    ):
+        """Uploads with a known filename return HTML and flash a warning,
+        new filenames return None with no flashes."""
         app_exist, data_dir = app_exist
 
-        # Create a dummy file
-        fake_file = io.BytesIO(b"hi")
+        # Record the earlier uploads
+        for name in recorded:
+            uploads._record_upload(data_dir, name)
 
-        # Name the dummy file
-        fake_file.filename = "example.csv"
+        fake_file = make_fake_file(*upload)
 
-        # Filename has not already been uploaded so "result" should = None
         with app_exist.test_request_context("/", method="POST"):
             result = uploads._check_existing_files(fake_file, data_dir)
+            flashed = get_flashed_messages(with_categories=True)
 
-            # Should NOT return template for first upload
+        if expected_flash is None:
+            # Should NOT return template for a new upload
             assert result is None
+            assert flashed == []
+        else:
+            # Check it returns an HTML string and flashes a warning
+            assert isinstance(result, str)
+            assert ("warning", expected_flash) in flashed
 
-            # Check uploaded_files.txt exists
-            uploaded_file = data_dir / "uploaded_files.txt"
-            assert uploaded_file.exists()
+        # Uploads are only recorded by _record_upload
+        assert uploads._load_known(data_dir / "uploaded_files.txt") == set(
+            recorded
+        )
 
-            # Check uploaded_files.txt contains the uploaded file
-            contents = uploaded_file.read_text().strip()
-            assert contents == "example.csv"
 
-            # No flash messages on first upload - ChatGPT
-            assert get_flashed_messages(with_categories=True) == []
+class TestRecordUpload:
+    """Tests for _record_upload and _load_known."""
 
-    def test_duplicate_upload_returns_template_and_flashes(self, app_exist):
-        """Duplicate upload returns HTML and flashes a warning."""
-        app_exist, data_dir = app_exist
+    def test_first_upload_creates_tracking_file(self, app_exist):
+        """_record_upload creates uploaded_files.txt."""
+        _, data_dir = app_exist
 
-        # Pre-create uploaded_files.txt
+        uploads._record_upload(data_dir, "example.csv")
+
+        # Check the filename was written
         uploaded_file = data_dir / "uploaded_files.txt"
-        uploaded_file.write_text("example.csv\n", encoding="utf-8")
+        assert uploaded_file.read_text().strip() == "example.csv"
 
-        # Make new dummy file
-        fake_file = io.BytesIO(b"hi again")
-        fake_file.filename = "example.csv"
+    def test_upload_appends_new_filename(self, app_exist):
+        """_record_upload appends a new filename to uploaded_files.txt."""
+        _, data_dir = app_exist
 
-        # A new file is uploaded but already exists so "result" should =
-        # a string
-        with app_exist.test_request_context("/", method="POST"):
-            result = uploads._check_existing_files(fake_file, data_dir)
+        # Pre-create uploaded_files.txt
+        uploaded_file = data_dir / "uploaded_files.txt"
+        uploaded_file.write_text("a.csv\nc.csv\n", encoding="utf-8")
 
-            # Check it returns an HTML string
-            assert isinstance(result, str)
-            assert "has already been uploaded" in result
+        uploads._record_upload(data_dir, "b.csv")
 
-            # Flash message present - ChatGPT
-            flashed = get_flashed_messages(with_categories=True)
-            assert (
-                "warning",
-                "⚠ example.csv has already been uploaded",
-            ) in flashed
+        # Check new file has been added to the end of the list
+        contents = uploaded_file.read_text().splitlines()
+        assert contents == ["a.csv", "c.csv", "b.csv"]
 
-    def test_upload_appends_new_filename(self, app_exist):
-        """Non-duplicate upload appends new filename to uploaded_files.txt."""
+        # Check the cache knows about it without re-reading the file
+        assert uploads._is_duplicate(
+            "b.csv", uploads._load_known(uploaded_file)
+        )
 
-        app_exist, data_dir = app_exist
+    def test_load_known_rereads_after_change(self, app_exist):
+        """_load_known reuses the cached entries until the file's
+        modification time changes."""
+        _, data_dir = app_exist
 
-        # Pre-create uploaded_files.txt
         uploaded_file = data_dir / "uploaded_files.txt"
-        uploaded_file.write_text("a.csv\nb.csv\n", encoding="utf-8")
+        uploaded_file.write_text("b.csv\na.csv\n", encoding="utf-8")
 
-        # Make new different file
-        fake_file = io.BytesIO(b"x")
-        fake_file.filename = "c.csv"
+        # Repeated loads of an unchanged file return the cached filenames
+        first = uploads._load_known(uploaded_file)
+        assert first == frozenset({"a.csv", "b.csv"})
+        assert uploads._load_known(uploaded_file) is first
 
-        # Filename has not already been uploaded so "result" should = None
-        with app_exist.test_request_context("/", method="POST"):
-            result = uploads._check_existing_files(fake_file, data_dir)
+        # A change to the file is picked up
+        uploaded_file.write_text("c.csv\n", encoding="utf-8")
+        stat = uploaded_file.stat()
+        os.utime(uploaded_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert uploads._load_known(uploaded_file) == {"c.csv"}
 
-            assert result is None
+        # Blank lines are skipped and non-ASCII names are kept
+        uploaded_file.write_text("\ncafé.csv\n  \n", encoding="utf-8")
+        os.utime(uploaded_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2))
+        assert uploads._load_known(uploaded_file) == {"café.csv"}
+
+        # A deleted file gives no filenames
+        uploaded_file.unlink()
+        assert uploads._load_known(uploaded_file) == frozenset()
+
+    def test_is_duplicate(self):
+        """_is_duplicate checks membership of the known entries."""
+        known = frozenset({"a.csv"})
 
-            # Check new file has been added to the list
-            contents = uploaded_file.read_text().splitlines()
-            assert contents == ["a.csv", "b.csv", "c.csv"]
+        assert uploads._is_duplicate("a.csv", known)
+        assert not uploads._is_duplicate("b.csv", known)
 
 
 @pytest.fixture
-def app_write(tmp_path):
+def app_write(app, tmp_path):
     """Flask app + data directory fixture for _write_to_csv tests."""
 
-    app = Flask(__name__)
-    app.secret_key = "testing"  # needed for flash()
-
     data_dir = tmp_path / "data"
     data_dir.mkdir()
 
     return app, data_dir
 
 
+@pytest.fixture
+def invoke_write(app_write):
+    """Context manager running _write_to_csv inside a request context.
+
+    Yields the data directory, with the request context still active so
+    flashed messages can be checked.
+    """
+    app, data_dir = app_write
+
+    @contextlib.contextmanager
+    def _invoke_write(fake_file, df):
+        with app.test_request_context("/", method="POST"):
+            uploads._write_to_csv(data_dir, fake_file, df)
+            yield data_dir
+
+    return _invoke_write
+
+
 class TestWriteToCsv:
     """Tests for _write_to_csv."""
-    def test_creates_new_csv_and_flashes(self, app_write):
-        """First write creates input_data.csv with header and flashes info."""
 
-        app_write, data_dir = app_write
+    def test_creates_new_csv_and_flashes(
+        self, invoke_write, make_fake_file
+    ):
+        """First write creates input_data.csv with header and flashes info."""
 
         # Create dummy pandas datarame
         df = pd.DataFrame({"Patient_ID": ["P1"], "col1": [123]})
 
         # Make a dummy file to get name from
-        fake_file = io.BytesIO(b"")
-        fake_file.filename = "test.csv"
+        fake_file = make_fake_file(b"", "test.csv")
 
         # Write pandas dataframe
-        with app_write.test_request_context("/", method="POST"):
-            uploads._write_to_csv(data_dir, fake_file, df)
-
+        with invoke_write(fake_file, df) as data_dir:
             # Check the new input file exists
             input_data_path = data_dir / "input_data.csv"
             assert input_data_path.exists()
@@ -295,28 +383,26 @@ class TestWriteToCsv:
             flashed = get_flashed_messages(with_categories=True)
             assert ("info", "Uploaded test.csv") in flashed
 
-    def test_appends_to_existing_csv(self, app_write):
+    def test_appends_to_existing_csv(
+        self, app_write, invoke_write, make_fake_file
+    ):
         """Subsequent writes append rows without duplicating headers and
         flash info."""
 
-        app_write, data_dir = app_write
+        _, data_dir = app_write
 
         input_data_path = data_dir / "input_data.csv"
 
         # Create an existing CSV file
-        existing = pd.DataFrame({"Patient_ID": ["OLD"], "col1": [1]})
-        existing.to_csv(input_data_path, index=False)
+        input_data_path.write_text("Patient_ID,col1\nOLD,1\n")
 
         # Dataframe with new data
         new_df = pd.DataFrame({"Patient_ID": ["NEW"], "col1": [2]})
 
         # Create fake input file to get name from
-        fake_file = io.BytesIO(b"")
-        fake_file.filename = "new.csv"
-
-        with app_write.test_request_context("/", method="POST"):
-            uploads._write_to_csv(data_dir, fake_file, new_df)
+        fake_file = make_fake_file(b"", "new.csv")
 
+        with invoke_write(fake_file, new_df):
             # Read lines to a list
             lines = input_data_path.read_text().strip().splitlines()
 
@@ -338,3 +424,50 @@ class TestWriteToCsv:
             # Flash message shown - ChatGPT
             flashed = get_flashed_messages(with_categories=True)
             assert ("info", "Uploaded new.csv") in flashed
+
+    def test_appends_reordered_columns_under_existing_header(
+        self, app_write, invoke_write, make_fake_file
+    ):
+        """Columns in a different order are lined up with the header."""
+
+        _, data_dir = app_write
+
+        input_data_path = data_dir / "input_data.csv"
+        input_data_path.write_text("Patient_ID,col1,col2\nOLD,1,2\n")
+
+        # Same columns as the file, in a different order
+        new_df = pd.DataFrame(
+            {"Patient_ID": ["NEW"], "col2": [4], "col1": [3]}
+        )
+
+        fake_file = make_fake_file(b"", "new.csv")
+
+        with invoke_write(fake_file, new_df):
+            written = pd.read_csv(input_data_path)
+
+        assert written["col1"].tolist() == [1, 3]
+        assert written["col2"].tolist() == [2, 4]
+
+    def test_rewrites_csv_when_new_columns_appear(
+        self, app_write, invoke_write, make_fake_file
+    ):
+        """New columns are added to the file, earlier rows left empty."""
+
+        _, data_dir = app_write
+
+        input_data_path = data_dir / "input_data.csv"
+        input_data_path.write_text("Patient_ID,col1\nOLD,1\n")
+
+        new_df = pd.DataFrame(
+            {"Patient_ID": ["NEW"], "col1": [2], "col2": [5]}
+        )
+
+        fake_file = make_fake_file(b"", "new.csv")
+
+        with invoke_write(fake_file, new_df):
+            written = pd.read_csv(input_data_path)
+
+        assert list(written.columns) == ["Patient_ID", "col1", "col2"]
+        assert written["Patient_ID"].tolist() == ["OLD", "NEW"]
+        assert pd.isna(written.loc[0, "col2"])
+        assert written.loc[1, "col2"] == 5
@@ -1,7 +1,7 @@
 import json
+import logging
 import re
 from pathlib import Path
-from unittest.mock import MagicMock, patch
 
 import pytest
 import requests
@@ -11,7 +11,16 @@ import parkVar.modules.validate as validate
 TEST_DATA_DIR = Path(__file__).resolve().parent / "test_data"
 
 
-@pytest.fixture
+def _warning_messages(caplog):
+    """Return the messages of the WARNING records captured by caplog."""
+    return [
+        record.message
+        for record in caplog.records
+        if record.levelno == logging.WARNING
+    ]
+
+
+@pytest.fixture(scope="session")
 def init_values():
     """Fixture for initial values and columns used when setting up df."""
     return {
@@ -24,14 +33,21 @@ def init_values():
     }
 
 
-@pytest.fixture(name="df")
-def setup_df(init_values):
-    """Fixture to set up DataFrame for testing."""
-    df = validate.setup_df(
+@pytest.fixture(scope="session")
+def baseline_df(init_values):
+    """DataFrame set up once from the test input. Tests use copies of it
+    through the `df` fixture."""
+    return validate.setup_df(
         input_csv_path=str(TEST_DATA_DIR / "test_input.csv"),
         vv_values=init_values
     )
-    return df
+
+
+@pytest.fixture(name="df")
+def setup_df(baseline_df):
+    """Fixture to set up DataFrame for testing. A copy, as some tests
+    update it."""
+    return baseline_df.copy(deep=True)
 
 
 class TestSetupDf:
@@ -73,6 +89,16 @@ class TestSetupDf:
                 f"Found: {actual_value}"
             )
 
+    def test_text_columns_read_as_strings(self, df):
+        """
+        Check that the known text columns are read as strings.
+
+        '#CHROM' would otherwise be parsed as integers for numbered
+        chromosomes, while 'POS' is still parsed as a number.
+        """
+        assert df.loc[0, "#CHROM"] == "17"
+        assert df.loc[0, "POS"] == 45983420
+
 
 def test_construct_vv_url():
     """
@@ -96,88 +122,113 @@ def test_construct_vv_url():
     )
 
 
-@pytest.fixture
-def mock_valid_vv_response():
+# Read-only, so parsed once and shared by every test
+@pytest.fixture(scope="session")
+def vv_responses():
+    """
+    Fixture to provide every mock Variant Validator response JSON in
+    test_data, keyed by file stem.
+    """
+    return {
+        fp.stem: json.loads(fp.read_bytes())
+        for fp in TEST_DATA_DIR.glob("*_vv_response.json")
+    }
+
+
+@pytest.fixture(scope="session")
+def mock_valid_vv_response(vv_responses):
     """
     Fixture to provide a mock response JSON for variant validator LOVD endpoint
     """
-    fp = TEST_DATA_DIR / "valid_vv_response.json"
-    return json.loads(fp.read_text())
+    return vv_responses["valid_vv_response"]
+
+
+@pytest.fixture
+def mock_get(monkeypatch):
+    """
+    Fixture to replace requests.get in validate with a fake endpoint.
+
+    Call it with the JSON body and status code to serve, or with exc to raise
+    that exception instead. Responses are real requests.Response objects, so
+    the code under test sees the same attributes as for a real request, but
+    json() hands back the given body itself rather than parsing a copy.
+    """
+    def _mock_get(json_body=None, status_code=200, exc=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(json_body).encode()
+        response.json = lambda **kwargs: json_body
+        calls = []
+
+        def fake_get(url, **kwargs):
+            calls.append(url)
+            if exc is not None:
+                raise exc
+            return response
+
+        monkeypatch.setattr(validate.requests, "get", fake_get)
+        return calls
+
+    return _mock_get
 
 
 class TestCallVariantValidator:
     """
     Tests for the call_variant_validator function in parkVar.modules.validate.
     """
-    def test_get_valid_response_when_request_ok(self, mock_valid_vv_response):
+    def test_get_valid_response_when_request_ok(
+        self, mock_get, mock_valid_vv_response
+    ):
         """
         This test checks that the get request response is successfully returned
         if the get request is successful (i.e. status code 200).
         """
-        mock_ok_response = MagicMock()
-        mock_ok_response.json.return_value = mock_valid_vv_response
-        mock_ok_response.status_code = 200
-
-        with patch(
-            'parkVar.modules.validate.requests.get',
-            return_value=mock_ok_response
-        ):
-            response_dict = validate.call_variant_validator(
-                url="https://test_url/test"
-                )
-
-            assert response_dict == mock_valid_vv_response, (
-                "Response dictionary does not match expected mock response."
-            )
+        calls = mock_get(json_body=mock_valid_vv_response)
 
-    def test_http_error_raised_on_bad_request(self):
+        response_dict = validate.call_variant_validator(
+            url="https://test_url/test"
+        )
+
+        assert response_dict is mock_valid_vv_response, (
+            "Response dictionary is not the mock response."
+        )
+        assert calls == ["https://test_url/test"]
+
+    def test_http_error_raised_on_bad_request(self, mock_get):
         """
         Assert HTTPError is raised when requests.get returns non-200 status
         code.
         """
-        mock_bad_response = MagicMock()
-        mock_bad_response.status_code = 400
-
-        with patch(
-            'parkVar.modules.validate.requests.get',
-            return_value=mock_bad_response
-        ):
-            with pytest.raises(requests.HTTPError):
-                validate.call_variant_validator(
-                    url="https://test_url/test"
-                )
-
-    def test_request_exception_reraised(self):
+        mock_get(status_code=400)
+
+        with pytest.raises(requests.HTTPError):
+            validate.call_variant_validator(url="https://test_url/test")
+
+    def test_request_exception_reraised(self, mock_get):
         """Ensure RequestException from requests.get is re-raised"""
-        with patch(
-            'parkVar.modules.validate.requests.get',
-            side_effect=requests.exceptions.RequestException("network fail")
-        ):
-            with pytest.raises(requests.exceptions.RequestException):
-                validate.call_variant_validator(
-                    url="https://test_url/test"
-                )
+        mock_get(exc=requests.exceptions.RequestException("network fail"))
 
+        with pytest.raises(requests.exceptions.RequestException):
+            validate.call_variant_validator(url="https://test_url/test")
 
-@pytest.fixture
-def mock_genomic_var_error_vv_response():
+
+@pytest.fixture(scope="session")
+def mock_genomic_var_error_vv_response(vv_responses):
     """
     Fixture to provide a mock response JSON for variant validator LOVD endpoint
     """
-    fp = TEST_DATA_DIR / "genomic_var_error_vv_response.json"
-    return json.loads(fp.read_text())
+    return vv_responses["genomic_var_error_vv_response"]
 
 
-@pytest.fixture
-def mock_two_transcript_error_vv_response():
+@pytest.fixture(scope="session")
+def mock_two_transcript_error_vv_response(vv_responses):
     """
     Fixture to provide a mock response JSON for variant validator LOVD endpoint
     """
-    fp = TEST_DATA_DIR / "two_transcript_error_vv_response.json"
-    return json.loads(fp.read_text())
+    return vv_responses["two_transcript_error_vv_response"]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def valid_parsed_vv_rspns():
     """
     Fixture to provide a valid parsed VV response dictionary.
@@ -204,76 +255,62 @@ def valid_parsed_vv_rspns():
 class TestParseVVResponse:
     """Tests for the parse_vv_response function in parkVar.modules.validate."""
 
-    def test_correctly_parses_response(
-            self,
-            mock_valid_vv_response,
-            valid_parsed_vv_rspns
-    ):
-        """
-        Test that parse_vv_response correctly extracts expected fields from
-        a mock Variant Validator response.
-        """
-        index = 0
-        parsed_output = validate.parse_vv_response(
-            vv_response=mock_valid_vv_response,
-            index=index
-        )
-
-        assert parsed_output == valid_parsed_vv_rspns[index], (
-            f"Parsed output does not match expected output.\n"
-            f"Expected: {valid_parsed_vv_rspns}\n"
-            f"Found: {parsed_output}"
-        )
-
-    def test_warning_given_for_genomic_variant_error(
+    @pytest.mark.parametrize(
+        "response_fixture,expected_index,warning_pattern",
+        [
+            # Valid response parsed into the expected fields, no warning
+            ("mock_valid_vv_response", 0, None),
+            # Error for the genomic variant description
+            ("mock_genomic_var_error_vv_response", None,
+             r"could not be validated"),
+            # More than one MANE Select transcript returned
+            ("mock_two_transcript_error_vv_response", None, r">1"),
+        ],
+        ids=["valid", "genomic_variant_error", "two_transcripts"]
+    )
+    def test_parses_response(
         self,
+        request,
         caplog,
-        mock_genomic_var_error_vv_response
+        valid_parsed_vv_rspns,
+        response_fixture,
+        expected_index,
+        warning_pattern
     ):
         """
-        Test that a warning is logged if the 'genomic_variant_error' field
-        in the VV response is not None.
+        Test that parse_vv_response extracts the expected fields from a
+        valid mock Variant Validator response, and that for an invalid
+        response it returns None and logs a single, matching warning.
         """
+        vv_response = request.getfixturevalue(response_fixture)
 
-        validate.parse_vv_response(
-            vv_response=mock_genomic_var_error_vv_response,
-            index=0
-        )
-        assert len(caplog.records) == 1, (
-            f"Expected one warning to be logged, but found"
-            f" {len(caplog.records)}."
-        )
+        with caplog.at_level(logging.WARNING, logger=validate.logger.name):
+            parsed_output = validate.parse_vv_response(
+                vv_response=vv_response,
+                index=0
+            )
+        warnings = _warning_messages(caplog)
+
+        if expected_index is not None:
+            expected_output = valid_parsed_vv_rspns[expected_index]
+            assert parsed_output == expected_output, (
+                f"Parsed output does not match expected output.\n"
+                f"Expected: {expected_output}\n"
+                f"Found: {parsed_output}"
+            )
+        else:
+            assert parsed_output is None
 
-        warning_message = caplog.records[0].message
+        expected_count = 0 if warning_pattern is None else 1
+        assert len(warnings) == expected_count, (
+            f"Expected {expected_count} warnings to be logged, but found"
+            f" {len(warnings)}."
+        )
 
         # Assert correct warning raised as two warnings could possibly be
         # raised by parse_vv_response
-        pattern = r"could not be validated"
-        assert re.search(pattern, warning_message)
-
-    def test_warning_when_two_transcripts_found(
-        self,
-        caplog,
-        mock_two_transcript_error_vv_response
-    ):
-        """
-        Test that a warning is logged if multiple transcripts are found in
-        the VV response.
-        """
-        validate.parse_vv_response(
-            vv_response=mock_two_transcript_error_vv_response,
-            index=0
-        )
-        assert len(caplog.records) == 1, (
-            f"Expected one warning to be logged, but found"
-            f" {len(caplog.records)}."
-        )
-
-        warning_message = caplog.records[0].message
-
-        # Assert correct warning raised
-        pattern = r">1"
-        assert re.search(pattern, warning_message)
+        if warning_pattern is not None:
+            assert re.search(warning_pattern, warnings[0])
 
 
 @pytest.fixture
@@ -317,20 +354,23 @@ class TestUpdateDfWithParsedVvValues:
                 f"Found: {actual_value}"
             )
 
-    def test_no_value_in_df_when_missing_value_in_parsed_response(
+    def test_missing_values_left_unset_with_warning(
         self,
         df,
-        incomplete_parsed_response
+        incomplete_parsed_response,
+        caplog
     ):
         """
-        Test that DataFrame retains None value when parsed VV response is
-        missing expected fields.
+        Test that DataFrame retains None value, and a warning is logged for
+        each, when the parsed VV response is missing expected fields.
         """
-        validate.update_df_with_parsed_vv_values(
-            df=df,
-            index=0,
-            vv_parsed_response=incomplete_parsed_response
-        )
+        with caplog.at_level(logging.WARNING, logger=validate.logger.name):
+            validate.update_df_with_parsed_vv_values(
+                df=df,
+                index=0,
+                vv_parsed_response=incomplete_parsed_response
+            )
+        warnings = _warning_messages(caplog)
 
         for col, expected_value in incomplete_parsed_response.items():
             actual_value = df.loc[0, col]
@@ -343,26 +383,11 @@ class TestUpdateDfWithParsedVvValues:
                 f"Found: {actual_value}"
             )
 
-    def test_warning_logged_when_missing_value_in_parsed_response(
-        self,
-        df,
-        incomplete_parsed_response,
-        caplog
-    ):
-        """
-        Test that a warning is logged when the parsed VV response is missing
-        expected fields.
-        """
-        validate.update_df_with_parsed_vv_values(
-            df=df,
-            index=0,
-            vv_parsed_response=incomplete_parsed_response
-        )
         none_count = sum(
             1 for v in incomplete_parsed_response.values() if v is None
         )
 
-        assert len(caplog.records) == none_count, (
+        assert len(warnings) == none_count, (
             f"Expected {none_count} warnings to be logged, but found"
-            f" {len(caplog.records)}."
+            f" {len(warnings)}."
         )